@@ -0,0 +1,88 @@
+import asyncio
+import time
+import traceback
+from functools import partial
+
+import aiohttp
+
+from engines import GOOGLE_URL, HTTP_COOKIES, HTTP_HEADERS, lang_code_for
+from logs import log_error
+from metrics import METRICS
+from ratecontrol import classify
+from sources import SourcePipeline, create_sources
+
+
+async def fetch_page(session, url, headers=None):
+    """Return (status, text, final url) of a GET request, for sources.SourcePipeline"""
+    async with session.get(url, headers=headers) as response:
+        return response.status, await response.text(), str(response.url)
+
+
+def create_session(lang, concurrency, timeout=10):
+    """Create a client session whose keep-alive connection pool is sized to the concurrency"""
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency, keepalive_timeout=30)
+    headers = dict(HTTP_HEADERS, **{"Accept-Language": lang_code_for(lang)})
+    return aiohttp.ClientSession(
+        connector=connector, headers=headers, cookies=HTTP_COOKIES, timeout=aiohttp.ClientTimeout(total=timeout)
+    )
+
+
+async def crawl(rows, lang, concurrency=100, on_result=None, base_url=GOOGLE_URL, timeout=10, should_stop=None,
+                rate=None, pipeline=None):
+    """Look up every row with at most `concurrency` requests in flight; row[1] and row[2] are artist and track.
+
+    on_result(row, lyrics, error, latency) is called on the event loop thread for each finished row,
+    where lyrics is None when no source had lyrics. should_stop() is polled before each new
+    row is scheduled. An optional ratecontrol.RateController further limits the request rate and
+    concurrency below `concurrency`. pipeline is a sources.SourcePipeline, by default Google at
+    base_url only. Returns the number of rows processed.
+    """
+    if pipeline is None:
+        pipeline = SourcePipeline(create_sources(None, base_url), lang)
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = set()
+    done = 0
+
+    async def lookup(session, row):
+        nonlocal done
+        artist, track_name = row[1], row[2]
+        lyrics, error = None, None
+        started = None
+        try:
+            if rate:
+                with METRICS.timed("rate_wait"):
+                    if not await rate.acquire_async():
+                        return  # Stopped while waiting; the row stays unprocessed
+            started = time.perf_counter()
+            try:
+                lyrics = await pipeline.lookup_async(artist, track_name, partial(fetch_page, session))
+            except Exception as e:
+                error = e
+            if rate:
+                rate.release(classify(lyrics, error))
+        finally:
+            semaphore.release()
+        done += 1
+        if on_result:
+            try:
+                on_result(row, lyrics, error, time.perf_counter() - started if started else 0.0)
+            except Exception as e:
+                log_error(f"crawl on_result error: {e}\n{traceback.format_exc()}")
+
+    async with create_session(lang, concurrency, timeout) as session:
+        for row in rows:
+            if should_stop and should_stop():
+                break
+            # Only create a task once a slot is free, so memory stays bounded by the concurrency
+            await semaphore.acquire()
+            task = asyncio.create_task(lookup(session, row))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    return done
+
+
+def run_crawl(rows, lang, concurrency=100, on_result=None, **kwargs):
+    """Blocking wrapper around crawl() for threads and scripts without an event loop"""
+    return asyncio.run(crawl(rows, lang, concurrency, on_result, **kwargs))
@@ -0,0 +1,416 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+
+from engines import LYRICS_ATTRID
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DATASETS = (
+    os.path.join(ROOT, "dependencies", "micro_music_library.csv"),
+    os.path.join(ROOT, "dependencies", "mini_music_library.csv"),
+)
+RESULTS_PATH = "bench_results.jsonl"
+
+HOME_PAGE = """<html><body><form action="/search" method="get">
+<input name="q" type="text" autofocus><input type="submit" value="Search">
+</form></body></html>"""
+
+LYRICS_PAGE = """<html><body><div id="search">
+<div data-attrid="{attrid}"><div><span>{line}</span><br><span>Second line of {line}</span></div>
+<div><span>Chorus of {line}</span></div><div>Translate to English</div><div>Translated</div></div>
+</div></body></html>"""
+
+NO_LYRICS_PAGE = """<html><body><div id="search"><div class="g"><a href="#">{line}</a></div></div></body></html>"""
+
+CAPTCHA_PAGE = """<html><body><form id="captcha-form" action="/sorry/index" method="post">
+<p>Our systems have detected unusual traffic from your computer network.</p>
+<div class="g-recaptcha"></div></form></body></html>"""
+
+
+class MockSearchHandler(BaseHTTPRequestHandler):
+    """Answer like the Google results page: the home page with a search box, and /search?q=...
+
+    Whether a query has lyrics is fixed per query; errors and CAPTCHAs are drawn per request,
+    so retried lookups eventually succeed like they do against the real site.
+    """
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        delay = max(0.0, server.latency + server.random(-server.jitter, server.jitter))
+        if delay:
+            time.sleep(delay)
+        if url.path == "/":
+            self.reply(200, HOME_PAGE)
+            return
+        if url.path != "/search":
+            self.reply(404, "<html><body>Not found</body></html>")
+            return
+        query = parse_qs(url.query).get("q", [""])[0]
+        draw = server.random(0, 1)
+        if draw < server.captcha_rate:
+            self.reply(429, CAPTCHA_PAGE)
+        elif draw < server.captcha_rate + server.error_rate:
+            self.reply(500, "<html><body>Server error</body></html>")
+        elif int(hashlib.sha1(query.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF < server.hit_rate:
+            self.reply(200, LYRICS_PAGE.format(attrid=LYRICS_ATTRID, line=query.replace("<", "")))
+        else:
+            self.reply(200, NO_LYRICS_PAGE.format(line=query.replace("<", "")))
+
+    def reply(self, status, html):
+        body = html.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockSearchServer(ThreadingHTTPServer):
+    """Local stand-in for the search engine with configurable latency, error and CAPTCHA rates"""
+
+    daemon_threads = True
+    request_queue_size = 1024  # The async engine opens hundreds of connections at once
+
+    def __init__(self, port=0, latency=0.05, jitter=0.02, hit_rate=0.8, error_rate=0.0, captcha_rate=0.0, seed=1):
+        super().__init__(("127.0.0.1", port), MockSearchHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.hit_rate = hit_rate
+        self.error_rate = error_rate
+        self.captcha_rate = captcha_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def random(self, low, high):
+        with self.rng_lock:
+            return self.rng.uniform(low, high)
+
+    def handle_error(self, request, client_address):
+        # Clients killed on purpose leave their requests behind; the broken connections are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="mock-search-server", daemon=True).start()
+        return self
+
+    def settings(self):
+        return {
+            "latency": self.latency,
+            "jitter": self.jitter,
+            "hit_rate": self.hit_rate,
+            "error_rate": self.error_rate,
+            "captcha_rate": self.captcha_rate,
+        }
+
+
+def git_commit():
+    """Return (commit, dirty) of the working tree, or ("unknown", False) outside a git checkout"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def process_tree_rss_mb(process):
+    """Return the resident memory of a process and all of its children in MB"""
+    import psutil
+
+    total = 0
+    try:
+        processes = [process] + process.children(recursive=True)
+    except psutil.Error:
+        return 0.0
+    for p in processes:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+
+def run_one(dataset, engine, workers, server, rate, output, timeout):
+    """Crawl dataset with cli.py in a scratch directory and return the measurements"""
+    import psutil
+
+    workdir = tempfile.mkdtemp(prefix="lyrics-bench-")
+    command = [
+        sys.executable, os.path.join(ROOT, "cli.py"), "crawl", dataset, "--engine", engine,
+        "--workers", str(workers), "--rate", str(rate), "--lang", "English", "--output", output,
+        "--base-url", server.url, "--no-cache", "--status-interval", "3600",
+    ]
+    log_path = os.path.join(workdir, "bench.log")
+    peak_rss = 0.0
+    started = time.perf_counter()
+    try:
+        with open(log_path, "w", encoding="utf-8") as log:
+            child = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+            process = psutil.Process(child.pid)
+            while child.poll() is None:
+                peak_rss = max(peak_rss, process_tree_rss_mb(process))
+                if time.perf_counter() - started > timeout:
+                    child.kill()
+                time.sleep(0.1)
+        wall = time.perf_counter() - started
+        snapshots = glob.glob(os.path.join(workdir, "crawl_state", "*-metrics.json"))
+        snapshot = {}
+        if snapshots:
+            with open(snapshots[0], encoding="utf-8") as f:
+                snapshot = json.load(f)
+        lookup = snapshot.get("stages", {}).get("lookup", {})
+        counters = snapshot.get("counters", {})
+        result = {
+            "exit_code": child.returncode,
+            "rows": snapshot.get("rows", 0),
+            "wall_seconds": round(wall, 3),
+            "crawl_seconds": round(snapshot.get("elapsed", 0.0), 3),
+            "rows_per_second": round(snapshot.get("rows_per_second", 0.0), 2),
+            "lookup_p50_ms": round(lookup.get("p50", 0.0) * 1000, 2),
+            "lookup_p95_ms": round(lookup.get("p95", 0.0) * 1000, 2),
+            "lookup_p99_ms": round(lookup.get("p99", 0.0) * 1000, 2),
+            "peak_rss_mb": round(peak_rss, 1),
+            "outcomes": {name: counters[name] for name in ("found", "no_panel", "blocked", "timeout", "error")
+                         if name in counters},
+        }
+        if child.returncode:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                result["log_tail"] = f.read()[-2000:]
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(args):
+    server = MockSearchServer(latency=args.latency, jitter=args.jitter, hit_rate=args.hit_rate,
+                              error_rate=args.error_rate, captcha_rate=args.captcha_rate, seed=args.seed).start()
+    commit, dirty = git_commit()
+    print(f"Mock server at {server.url}, commit {commit}{' (dirty)' if dirty else ''}", flush=True)
+    print(HEADER, flush=True)
+    try:
+        with open(args.results, "a", encoding="utf-8") as results:
+            for dataset in args.datasets:
+                for engine in args.engines:
+                    for workers in args.workers:
+                        result = run_one(dataset, engine, workers, server, args.rate, args.output, args.timeout)
+                        record = {
+                            "commit": commit,
+                            "dirty": dirty,
+                            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                            "python": platform.python_version(),
+                            "platform": platform.platform(),
+                            "dataset": os.path.basename(dataset),
+                            "engine": engine,
+                            "workers": workers,
+                            "output": args.output,
+                            "server": server.settings(),
+                            **result,
+                        }
+                        results.write(json.dumps(record) + "\n")
+                        results.flush()
+                        print(format_record(record), flush=True)
+                        if result["exit_code"]:
+                            print(result.get("log_tail", ""), file=sys.stderr)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return 0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def coordinator_progress(url):
+    try:
+        with urlopen(url + "/progress", timeout=5) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+def check_distributed(args):
+    """Crawl the first dataset with a coordinator and args.distributed worker clients, SIGKILL one client
+    once it holds leases and check that they are taken over: every row ends up finished, and without
+    injected errors every row is recorded exactly once. Returns 0 when the check passes.
+    """
+    server = MockSearchServer(latency=args.latency, jitter=args.jitter, hit_rate=args.hit_rate,
+                              error_rate=args.error_rate, captcha_rate=args.captcha_rate, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="lyrics-bench-")
+    url = f"http://127.0.0.1:{free_port()}"
+    processes = {}
+    logs = []
+
+    def spawn(name, *command):
+        log = open(os.path.join(workdir, f"{name}.log"), "w", encoding="utf-8")
+        logs.append(log)
+        processes[name] = subprocess.Popen([sys.executable, os.path.join(ROOT, "cli.py"), *command], cwd=workdir,
+                                           stdout=log, stderr=subprocess.STDOUT)
+        return processes[name]
+
+    problems = []
+    started = time.perf_counter()
+    try:
+        coordinator = spawn(
+            "coordinator", "coordinate", os.path.abspath(args.datasets[0]), "--host", "127.0.0.1",
+            "--port", url.rsplit(":", 1)[1], "--lang", "English", "--base-url", server.url, "--output", args.output,
+            "--no-cache", "--lease-seconds", str(args.lease_seconds), "--linger", "2", "--status-interval", "3600",
+        )
+        while coordinator_progress(url) is None:
+            if coordinator.poll() is not None or time.perf_counter() - started > 60:
+                raise RuntimeError("The coordinator did not start")
+            time.sleep(0.2)
+        for i in range(args.distributed):
+            spawn(f"client-{i}", "work", url, "--engine", "http", "--workers", str(args.workers[0]),
+                  "--rate", str(args.rate), "--name", f"client-{i}", "--status-interval", "3600")
+        killed_at = None
+        while coordinator.poll() is None:
+            if time.perf_counter() - started > args.timeout:
+                problems.append(f"not finished after {args.timeout:.0f}s")
+                break
+            progress = coordinator_progress(url)
+            if killed_at is None and progress and progress["workers"].get("client-0", {}).get("lookups"):
+                processes["client-0"].kill()
+                killed_at = time.perf_counter()
+                print(f"Killed client-0 at {progress['finished']}/{progress['total']} lookups", flush=True)
+            time.sleep(0.2)
+        if killed_at is None:
+            problems.append("client-0 never reported a lookup, nothing was killed")
+        wall = time.perf_counter() - started
+        for name, process in processes.items():
+            if process.poll() is None:
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    problems.append(f"{name} still running after the coordinator exited")
+        stores = [path for path in glob.glob(os.path.join(workdir, "crawl_state", "*.sqlite"))
+                  if "cache" not in os.path.basename(path)]
+        if not stores:
+            problems.append("no job store was written")
+        else:
+            conn = sqlite3.connect(stores[0])
+            try:
+                counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+                repeated = conn.execute("SELECT COUNT(*) FROM jobs WHERE attempts > 1").fetchone()[0]
+            finally:
+                conn.close()
+            print(f"{args.distributed} clients, lease {args.lease_seconds:g}s: {wall:.1f}s, "
+                  + ", ".join(f"{status} {count}" for status, count in sorted(counts.items())), flush=True)
+            if counts.get("pending"):
+                problems.append(f"{counts['pending']} rows left pending")
+            if repeated and not (args.error_rate or args.captcha_rate):
+                problems.append(f"{repeated} rows recorded more than once")
+    except RuntimeError as e:
+        problems.append(str(e))
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        for log in logs:
+            log.close()
+        server.shutdown()
+        server.server_close()
+        if problems:
+            for name in sorted(processes):
+                with open(os.path.join(workdir, f"{name}.log"), encoding="utf-8", errors="replace") as f:
+                    print(f"--- {name}\n{f.read()[-1500:]}", file=sys.stderr)
+        shutil.rmtree(workdir, ignore_errors=True)
+    for problem in problems:
+        print(f"FAILED: {problem}", file=sys.stderr)
+    if not problems:
+        print("Distributed check passed", flush=True)
+    return 1 if problems else 0
+
+
+HEADER = (f"{'commit':<10} {'dataset':<26} {'engine':<6} {'workers':>7} {'rows':>6} {'rows/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak MB':>8}")
+
+
+def format_record(record):
+    commit = record["commit"] + ("+" if record.get("dirty") else "")
+    return (f"{commit:<10} {record['dataset']:<26} {record['engine']:<6} {record['workers']:>7} {record['rows']:>6} "
+            f"{record['rows_per_second']:>8.1f} {record['lookup_p50_ms']:>8.1f} {record['lookup_p95_ms']:>8.1f} "
+            f"{record['lookup_p99_ms']:>8.1f} {record['peak_rss_mb']:>8.1f}")
+
+
+def report(args):
+    """Print the recorded runs grouped by configuration, oldest first, to compare commits"""
+    if not os.path.exists(args.results):
+        print(f"No results in {args.results}")
+        return 1
+    with open(args.results, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: (r["dataset"], r["engine"], r["workers"], r["timestamp"]))
+    print(HEADER)
+    for record in records:
+        print(format_record(record))
+    return 0
+
+
+def csv_list(convert):
+    return lambda value: [convert(part) for part in value.split(",") if part]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the crawler against a local mock search server and append the results to a file"
+    )
+    parser.add_argument("--datasets", type=csv_list(str), default=list(DATASETS), help="Comma-separated CSV files")
+    parser.add_argument("--engines", type=csv_list(str), default=["http", "async"],
+                        help="Comma-separated engines: chrome, http, auto, async")
+    parser.add_argument("--workers", type=csv_list(int), default=[5, 20, 50], help="Comma-separated worker counts")
+    parser.add_argument("--rate", type=float, default=10000.0, help="Max requests per second passed to the crawler")
+    parser.add_argument("--output", choices=("tree", "archive"), default="archive")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Latency varies uniformly by +/- this much")
+    parser.add_argument("--hit-rate", type=float, default=0.8, help="Share of songs whose page has lyrics")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="Share of requests answered with a CAPTCHA")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=1800.0, help="Seconds before a run is killed")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument("--report", action="store_true", help="Only print the results recorded so far")
+    parser.add_argument("--distributed", type=int, metavar="CLIENTS",
+                        help="Instead of benchmarking, check that a coordinator with this many worker clients "
+                             "finishes every row once after one client is killed")
+    parser.add_argument("--lease-seconds", type=float, default=10.0, help="Coordinator lease time with --distributed")
+    args = parser.parse_args(argv)
+    if args.report:
+        return report(args)
+    if args.distributed:
+        return check_distributed(args)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
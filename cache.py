@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.path.join("crawl_state", "lyrics_cache.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lyrics_cache (
+    cache_key TEXT PRIMARY KEY,
+    lyrics TEXT,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+class LyricsCache:
+    """Persistent lyrics cache keyed by normalize.canonical_key, shared by every dataset.
+
+    Hits live for ttl seconds. Misses ("Not Found") are cached too, but only for negative_ttl
+    seconds, so songs whose lyrics panel appears later are retried. Safe to share between threads.
+    Entries are scoped by lang, since the lyrics are cut at that language's translation, and misses
+    also by the lyrics sources that were asked (see sources.SOURCES; None is Google only).
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=90 * 24 * 3600, negative_ttl=7 * 24 * 3600, lang=None, sources=None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hit_prefix = f"{lang}\x1e" if lang else ""
+        self.miss_prefix = self.hit_prefix + ",".join(sorted(sources or ["google"])) + "\x1e"
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def scoped(self, key, lyrics):
+        return (self.hit_prefix if lyrics is not None else self.miss_prefix) + key
+
+    def get(self, key):
+        """Return (hit, lyrics). lyrics is None for a cached miss."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT lyrics, fetched_at FROM lyrics_cache WHERE cache_key IN (?, ?)",
+                (self.hit_prefix + key, self.miss_prefix + key),
+            ).fetchall()
+        now = time.time()
+        # Lyrics found since a miss was cached win over the miss
+        for lyrics, fetched_at in sorted(rows, key=lambda row: row[0] is None):
+            ttl = self.ttl if lyrics is not None else self.negative_ttl
+            if now - fetched_at <= ttl:
+                return True, lyrics
+        return False, None
+
+    def put(self, key, lyrics):
+        """Cache lyrics for a key; pass None to record a miss"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO lyrics_cache (cache_key, lyrics, fetched_at) VALUES (?, ?, ?)",
+                (self.scoped(key, lyrics), lyrics, time.time()),
+            )
+
+    def put_many(self, entries):
+        """Cache (key, lyrics) pairs in one transaction"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO lyrics_cache (cache_key, lyrics, fetched_at) VALUES (?, ?, ?)",
+                [(self.scoped(key, lyrics), lyrics, now) for key, lyrics in entries],
+            )
+
+    def purge_expired(self):
+        """Delete expired entries"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM lyrics_cache WHERE (lyrics IS NOT NULL AND fetched_at < ?) "
+                "OR (lyrics IS NULL AND fetched_at < ?)",
+                (now - self.ttl, now - self.negative_ttl),
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
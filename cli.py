@@ -0,0 +1,329 @@
+import argparse
+import os
+import sys
+import threading
+import time
+import traceback
+
+from engines import ENGINES, GOOGLE_URL
+from export import FORMATS, export_dataset
+from ingest import parse_shard
+from logs import LOG_PATH, log_error
+from output import DEDUP, DEDUP_PATH, OUTPUTS, TREE, merge_outputs, open_output, output_kind
+from sources import SOURCES
+from store import state_path_for
+from worker import CrawlJob
+
+
+def shard_arg(value):
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def sources_arg(value):
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SOURCES]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(f"expected a comma-separated list of {', '.join(SOURCES)}")
+    return names
+
+
+def print_status(job, started):
+    """Print one progress line: lookups finished, throughput and rate controller state"""
+    queue = job.work_queue
+    elapsed = time.monotonic() - started
+    per_second = queue.finished / elapsed if elapsed else 0
+    stats = job.rate.snapshot()
+    paused = f", paused {stats['paused_for']:.0f}s" if stats["paused_for"] else ""
+    print(
+        f"[{elapsed:7.0f}s] {queue.finished}/{queue.total} lookups, {per_second:.1f}/s | "
+        f"concurrency {stats['concurrency']}, {stats['rate']} req/s{paused} | found {stats['found']}, "
+        f"no lyrics {stats['no_panel']}, blocked {stats['blocked']}, timeouts {stats['timeout']}, "
+        f"errors {stats['error']}",
+        flush=True,
+    )
+
+
+def run_workers(job, args):
+    """Run the job's workers until they are done or Ctrl+C, printing a status line every status_interval"""
+    on_log = (lambda worker_id, message: print(f"Worker {worker_id + 1}: {message}", flush=True)) if args.verbose else None
+    cores = job.create_workers(on_log=on_log)
+    threads = [threading.Thread(target=core.run, name=f"worker-{core.worker_id}", daemon=True) for core in cores]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    try:
+        next_status = started + args.status_interval
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.2)
+            if time.monotonic() >= next_status:
+                print_status(job, started)
+                next_status += args.status_interval
+    except KeyboardInterrupt:
+        print("Interrupted, saving results...", flush=True)
+        job.stop()
+        for core in cores:
+            core.stop()
+        for thread in threads:
+            thread.join()
+    print_status(job, started)
+
+
+def crawl(args):
+    job = CrawlJob(args.csv, args.lang, args.engine, args.workers, args.rate, args.output, args.output_path,
+                   args.shard, not args.no_cache, args.base_url, args.processes, args.sources, args.parallel_sources)
+    try:
+        job.open()
+        shard = f" (shard {args.shard[0]}/{args.shard[1]})" if args.shard else ""
+        print(f"{job.total_rows} rows{shard}, {job.pending_rows} pending in {job.pending_keys} lookups", flush=True)
+        if job.rewritten_rows:
+            print(f"Output changed since the last run: wrote the {job.rewritten_rows} rows done before to it",
+                  flush=True)
+        run_workers(job, args)
+        job.close_engines()
+        job.writer.close()
+        job.writer = None
+        counts = job.store.counts()
+        print("Finished: " + ", ".join(f"{status} {count}" for status, count in sorted(counts.items())), flush=True)
+    finally:
+        job.close()
+    print(job.summary(), flush=True)
+    return 0
+
+
+def coordinate(args):
+    from coordinator import Coordinator, CoordinatorServer, is_loopback
+
+    if not args.token and not is_loopback(args.host):
+        # Anyone on the network could otherwise lease tasks and report made-up lyrics
+        print(f"Listening on {args.host} requires --token", file=sys.stderr)
+        return 1
+    job = CrawlJob(args.csv, args.lang, "remote", max_rate=args.rate, output_kind=args.output,
+                   output_path=args.output_path, shard=args.shard, use_cache=not args.no_cache,
+                   base_url=args.base_url, sources=args.sources, parallel_sources=args.parallel_sources)
+    server = None
+    try:
+        job.open()
+        print(f"{job.total_rows} rows, {job.pending_rows} pending in {job.pending_keys} lookups", flush=True)
+        if job.rewritten_rows:
+            print(f"Output changed since the last run: wrote the {job.rewritten_rows} rows done before to it",
+                  flush=True)
+        coordinator = Coordinator(job, args.lease_size, args.lease_seconds,
+                                  on_log=lambda message: print(message, flush=True), log_lookups=args.verbose)
+        coordinator.start()
+        server = CoordinatorServer(coordinator, args.host, args.port, args.token).start()
+        print(f"Coordinating on http://{args.host}:{server.server_port}; start workers with "
+              f"python cli.py work http://<this machine>:{server.server_port}", flush=True)
+        try:
+            next_status = time.monotonic() + args.status_interval
+            while not coordinator.is_done():
+                time.sleep(0.2)
+                if time.monotonic() >= next_status:
+                    print_progress(coordinator.progress())
+                    next_status += args.status_interval
+            # Keep answering for a moment, so polling workers learn that the crawl is over
+            time.sleep(args.linger)
+        except KeyboardInterrupt:
+            print("Interrupted, saving results...", flush=True)
+        coordinator.stop()
+        print_progress(coordinator.progress())
+        job.writer.close()
+        job.writer = None
+        counts = job.store.counts()
+        print("Finished: " + ", ".join(f"{status} {count}" for status, count in sorted(counts.items())), flush=True)
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        job.close()
+    print(job.summary(), flush=True)
+    return 0
+
+
+def print_progress(progress):
+    """Print one coordinator status line"""
+    outcomes = progress["outcomes"]
+    print(
+        f"{progress['finished']}/{progress['total']} lookups, {progress['per_second']:.1f}/s, "
+        f"{progress['leased']} leased to {len(progress['workers'])} workers | found {outcomes.get('found', 0)}, "
+        f"no lyrics {outcomes.get('no_panel', 0)}, blocked {outcomes.get('blocked', 0)}, "
+        f"timeouts {outcomes.get('timeout', 0)}, errors {outcomes.get('error', 0)}",
+        flush=True,
+    )
+
+
+def work(args):
+    from coordinator import WorkerClient
+
+    client = WorkerClient(args.url, args.engine, args.workers, args.rate, args.name, args.token)
+    try:
+        client.open()
+        print(f"Working for {args.url} as {client.name}: {client.pending_keys} lookups pending", flush=True)
+        run_workers(client, args)
+    finally:
+        client.close()
+    print(client.summary(), flush=True)
+    return 0
+
+
+def merge(args):
+    if args.destination.endswith(".sqlite"):
+        # Job stores: python cli.py merge crawl_state/all.sqlite shard1.sqlite shard2.sqlite
+        from store import JobStore
+
+        store = JobStore(args.destination)
+        try:
+            for source in args.sources:
+                store.merge_from(source)
+            counts = store.counts()
+        finally:
+            store.close()
+        print("Merged job store: " + ", ".join(f"{status} {count}" for status, count in sorted(counts.items())))
+        return 0
+    missing = [source for source in args.sources if not os.path.isdir(source)]
+    if missing:
+        print(f"Not an output folder: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    merge_outputs(args.destination, args.sources, args.output)
+    print(f"Merged {len(args.sources)} outputs into {args.destination}")
+    return 0
+
+
+def export(args):
+    store_path = args.state or state_path_for(args.csv, args.shard)
+    if not os.path.exists(store_path):
+        print(f"No crawl results for {args.csv} (looked for {store_path}); crawl it first or pass --state",
+              file=sys.stderr)
+        return 1
+    started = time.monotonic()
+    counts = export_dataset(args.csv, store_path, args.destination, args.format, args.chunksize)
+    print(f"Exported {sum(counts.values())} rows to {args.destination} in {time.monotonic() - started:.1f}s: "
+          + ", ".join(f"{status} {count}" for status, count in sorted(counts.items())))
+    return 0
+
+
+def shared(args):
+    if output_kind(args.output) != DEDUP:
+        print(f"Not a deduplicated output (crawl with --output dedup): {args.output}", file=sys.stderr)
+        return 1
+    output = open_output(DEDUP, args.output)
+    try:
+        stats = output.stats()
+        saved = 1 - stats["text_bytes"] / stats["undeduplicated_bytes"] if stats["undeduplicated_bytes"] else 0
+        print(f"{stats['songs']} songs, {stats['not_found']} without lyrics, {stats['texts']} distinct lyrics "
+              f"({saved:.0%} saved by deduplication), {stats['stored_bytes'] / 1024 / 1024:.1f} MB stored")
+        for i, (digest, songs) in enumerate(output.shared_lyrics(args.min_songs)):
+            if args.limit and i >= args.limit:
+                break
+            print(f"{digest[:12]}  " + " | ".join(f"{artist} - {track_name}" for artist, track_name in songs))
+    finally:
+        output.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape lyrics without the GUI, e.g. on a headless server or from cron")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    crawl_parser = commands.add_parser("crawl", help="Crawl a CSV file with artists and track_name columns")
+    crawl_parser.add_argument("csv")
+    crawl_parser.add_argument("--engine", choices=ENGINES + ("async",), default="http")
+    crawl_parser.add_argument("--workers", type=int, default=5,
+                              help="Worker threads, or requests in flight for the async engine")
+    crawl_parser.add_argument("--processes", type=int, default=1,
+                              help="Worker processes sharing --workers and --rate (e.g. the number of CPU cores)")
+    crawl_parser.add_argument("--rate", type=float, default=5.0, help="Max requests per second")
+    crawl_parser.add_argument("--lang", choices=("Chinese", "English"), default="Chinese", help="Official language")
+    crawl_parser.add_argument("--output", choices=OUTPUTS, default=TREE)
+    crawl_parser.add_argument("--output-path", help="Output folder (default lyrics/ or lyrics.archive/)")
+    crawl_parser.add_argument("--shard", type=shard_arg, metavar="I/N",
+                              help="Only crawl slice I of N, so N machines can split one dataset")
+    crawl_parser.add_argument("--base-url", default=GOOGLE_URL, help="Search engine URL, e.g. a regional Google domain")
+    crawl_parser.add_argument("--sources", type=sources_arg, default=["google"],
+                              help=f"Lyrics sources of the HTTP engines, tried in this order: {', '.join(SOURCES)}")
+    crawl_parser.add_argument("--parallel-sources", action="store_true",
+                              help="Ask every source at once and keep the first lyrics, instead of one after another")
+    crawl_parser.add_argument("--no-cache", action="store_true", help="Neither read nor fill the lyrics cache")
+    crawl_parser.add_argument("--status-interval", type=float, default=10.0, help="Seconds between status lines")
+    crawl_parser.add_argument("--verbose", action="store_true", help="Print every worker log line")
+    crawl_parser.set_defaults(func=crawl)
+
+    coordinate_parser = commands.add_parser(
+        "coordinate", help="Serve a CSV's lookups to workers on other machines (see the work command)"
+    )
+    coordinate_parser.add_argument("csv")
+    coordinate_parser.add_argument("--host", default="127.0.0.1",
+                                   help="Address to listen on, e.g. 0.0.0.0 for every network (requires --token)")
+    coordinate_parser.add_argument("--port", type=int, default=8700)
+    coordinate_parser.add_argument("--token", help="Shared secret the workers must send")
+    coordinate_parser.add_argument("--lease-size", type=int, default=50, help="Most lookups handed out at once")
+    coordinate_parser.add_argument("--lease-seconds", type=float, default=120.0,
+                                   help="Lookups of a worker that has not reported for this long are handed out again")
+    coordinate_parser.add_argument("--rate", type=float, default=5.0,
+                                   help="Only used to pace retries of blocked lookups; each worker sets its own rate")
+    coordinate_parser.add_argument("--lang", choices=("Chinese", "English"), default="Chinese", help="Official language")
+    coordinate_parser.add_argument("--output", choices=OUTPUTS, default=TREE)
+    coordinate_parser.add_argument("--output-path", help="Output folder (default lyrics/, lyrics.archive/ or lyrics.dedup/)")
+    coordinate_parser.add_argument("--shard", type=shard_arg, metavar="I/N", help="Only serve slice I of N")
+    coordinate_parser.add_argument("--base-url", default=GOOGLE_URL, help="Search engine URL used by the workers")
+    coordinate_parser.add_argument("--sources", type=sources_arg, default=["google"],
+                                   help=f"Lyrics sources used by the workers: {', '.join(SOURCES)}")
+    coordinate_parser.add_argument("--parallel-sources", action="store_true")
+    coordinate_parser.add_argument("--no-cache", action="store_true", help="Neither read nor fill the lyrics cache")
+    coordinate_parser.add_argument("--status-interval", type=float, default=10.0, help="Seconds between status lines")
+    coordinate_parser.add_argument("--linger", type=float, default=5.0,
+                                   help="Seconds to keep serving after the last lookup, so workers see the end")
+    coordinate_parser.add_argument("--verbose", action="store_true", help="Print every lookup reported by the workers")
+    coordinate_parser.set_defaults(func=coordinate)
+
+    work_parser = commands.add_parser("work", help="Crawl for a coordinator started with the coordinate command")
+    work_parser.add_argument("url", help="Coordinator address, e.g. http://192.168.1.10:8700")
+    work_parser.add_argument("--engine", choices=ENGINES + ("async",), default="http")
+    work_parser.add_argument("--workers", type=int, default=5,
+                             help="Worker threads, or requests in flight for the async engine")
+    work_parser.add_argument("--rate", type=float, default=5.0, help="Max requests per second of this machine")
+    work_parser.add_argument("--name", help="Worker name shown by the coordinator (default: host name)")
+    work_parser.add_argument("--token", help="Shared secret of the coordinator")
+    work_parser.add_argument("--status-interval", type=float, default=10.0, help="Seconds between status lines")
+    work_parser.add_argument("--verbose", action="store_true", help="Print every worker log line")
+    work_parser.set_defaults(func=work)
+
+    merge_parser = commands.add_parser(
+        "merge", help="Merge the outputs (or *.sqlite job stores) of several shards into destination"
+    )
+    merge_parser.add_argument("destination")
+    merge_parser.add_argument("sources", nargs="+")
+    merge_parser.add_argument("--output", choices=OUTPUTS,
+                              help="Kind of a new destination output (default: that of the first source)")
+    merge_parser.set_defaults(func=merge)
+
+    export_parser = commands.add_parser(
+        "export", help="Write the input CSV with the crawled lyrics, status and source added as columns"
+    )
+    export_parser.add_argument("csv")
+    export_parser.add_argument("destination", help="A .csv, .parquet or .feather file (Parquet and Feather need pyarrow)")
+    export_parser.add_argument("--format", choices=FORMATS, help="Default: from the destination's extension")
+    export_parser.add_argument("--shard", type=shard_arg, metavar="I/N", help="Use the results of this shard's crawl")
+    export_parser.add_argument("--state", help="Job store to read instead of the CSV's own, e.g. one merged from shards")
+    export_parser.add_argument("--chunksize", type=int, default=10000, help="Rows read and written at a time")
+    export_parser.set_defaults(func=export)
+
+    shared_parser = commands.add_parser("shared", help="List songs with identical lyrics in a deduplicated output")
+    shared_parser.add_argument("output", nargs="?", default=DEDUP_PATH)
+    shared_parser.add_argument("--min-songs", type=int, default=2, help="Only list lyrics shared by this many songs")
+    shared_parser.add_argument("--limit", type=int, default=0, help="Stop after this many groups (0: all)")
+    shared_parser.set_defaults(func=shared)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except Exception as e:
+        log_error(f"cli {args.command} error: {e}\n{traceback.format_exc()}")
+        print(f"Error: {e} (see {LOG_PATH})", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,537 @@
+import ipaddress
+import json
+import queue
+import socket
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from engines import BROWSER_ENGINES, GOOGLE_URL, DriverPool, HttpEngine, Lyrics
+from logs import log_error
+from metrics import METRICS
+from procpool import RemoteTasks
+from ratecontrol import RateController, classify
+from worker import AsyncLookupWorker, LookupWorker
+
+DEFAULT_PORT = 8700
+TOKEN_HEADER = "X-Coordinator-Token"
+
+
+class Lease:
+    """Tasks handed to one remote worker until they are reported back or the lease expires"""
+
+    def __init__(self, lease_id, worker, tasks, expires):
+        self.lease_id = lease_id
+        self.worker = worker
+        self.tasks = {task[0]: task for task in tasks}  # Task key -> task not reported yet
+        self.expires = expires
+
+
+class Coordinator:
+    """Share a CrawlJob's work queue between worker clients on other machines.
+
+    Clients lease chunks of up to lease_size tasks and post results back in batches; each post
+    renews the lease for lease_seconds. Leases that are not renewed in time (a dead or unplugged
+    worker) are reclaimed and their tasks handed out again, and results for a reclaimed lease are
+    refused, so no row is crawled twice into the output or lost. Results are recorded with the
+    job's writer, store and retry rules by one LookupWorker per client. The job is opened
+    with engine_name "remote", so it starts no engines of its own. Safe to share between threads.
+    """
+
+    def __init__(self, job, lease_size=50, lease_seconds=120, on_log=None, log_lookups=False):
+        self.job = job
+        self.lease_size = lease_size
+        self.lease_seconds = lease_seconds
+        self.on_log = on_log
+        self.log_lookups = log_lookups  # Also pass on the log line of every recorded lookup
+        self.leases = {}  # lease_id -> Lease
+        self.workers = {}  # client name -> LookupWorker recording its results
+        self.last_seen = {}  # client name -> time.monotonic() of its last request
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.started = time.monotonic()
+
+    def log(self, message):
+        if self.on_log:
+            self.on_log(message)
+
+    def start(self):
+        threading.Thread(target=self.reap_loop, name="coordinator-reaper", daemon=True).start()
+
+    def config(self):
+        """Settings the clients must share, and the size of the job"""
+        job = self.job
+        return {
+            "lang": job.lang,
+            "base_url": job.base_url,
+            "sources": job.sources,
+            "parallel_sources": job.parallel_sources,
+            "total_rows": job.total_rows,
+            "pending_rows": job.pending_rows,
+            "pending_keys": job.pending_keys,
+            "lease_seconds": self.lease_seconds,
+            "progress": self.progress(),
+        }
+
+    def worker_for(self, name):
+        with self.lock:
+            self.last_seen[name] = time.monotonic()
+            worker = self.workers.get(name)
+            if worker is None:
+                job = self.job
+                on_log = (lambda worker_id, message: self.log(f"{name}: {message}")) if self.log_lookups else None
+                worker = self.workers[name] = LookupWorker(
+                    len(self.workers), job.work_queue, job.lang, job.writer, "remote", cache=job.cache,
+                    rate=job.rate, on_log=on_log, base_url=job.base_url,
+                )
+                self.log(f"Worker {name} joined")
+            return worker
+
+    def lease(self, name, n):
+        """Lease up to n tasks to a client, answering cache hits here"""
+        worker = self.worker_for(name)
+        work_queue = self.job.work_queue
+        tasks = []
+        while len(tasks) < min(max(n, 1), self.lease_size) and not self.stopped.is_set():
+            leased = work_queue.lease(1, block=False)
+            if not leased:
+                break
+            if not worker.serve_from_cache(leased[0]):
+                tasks.append(leased[0])
+        reply = {"lease": None, "tasks": [], "done": work_queue.is_done(), "progress": self.progress()}
+        if tasks:
+            lease = Lease(uuid.uuid4().hex, name, tasks, time.monotonic() + self.lease_seconds)
+            with self.lock:
+                self.leases[lease.lease_id] = lease
+            reply.update(lease=lease.lease_id, tasks=tasks)
+        else:
+            # Nothing to hand out now, but failed or blocked tasks may come back
+            reply["retry_after"] = min(work_queue.next_ready_in() or 1.0, 5.0)
+        return reply
+
+    def submit(self, name, leases, release=False):
+        """Record results posted as {lease_id: [[key, lyrics, outcome, message, latency, source], ...]}.
+
+        Every lease named is renewed, even with no results, or with release=True (a client that
+        stops) handed back with its remaining tasks. Returns the numbers of results accepted and
+        refused and the ids of leases that are gone, whose remaining tasks the client should drop.
+        """
+        worker = self.worker_for(name)
+        accepted, expired, released, refused = [], [], [], 0
+        with self.lock:
+            now = time.monotonic()
+            for lease_id, results in leases.items():
+                lease = self.leases.get(lease_id)
+                if lease is None or lease.worker != name:
+                    expired.append(lease_id)
+                    refused += len(results)
+                    continue
+                lease.expires = now + self.lease_seconds
+                for key, lyrics, outcome, message, latency, source in results:
+                    task = lease.tasks.pop(key, None)
+                    if task is None:
+                        refused += 1
+                        continue
+                    accepted.append((task, Lyrics(lyrics, source) if lyrics else None, outcome, message, latency))
+                if release or not lease.tasks:
+                    del self.leases[lease_id]
+                    released.extend(lease.tasks.values())
+        # Recorded outside the lock: the writer may block while the disk catches up
+        for task, lyrics, outcome, message, latency in accepted:
+            worker.handle_reported(task, lyrics, outcome, message, latency)
+        if released:
+            self.job.work_queue.release(released)
+            self.log(f"Worker {name} left, {len(released)} tasks handed out again")
+        return {"accepted": len(accepted), "refused": refused, "expired": expired, "progress": self.progress()}
+
+    def reap_loop(self):
+        while not self.stopped.wait(1.0):
+            try:
+                self.reap()
+            except Exception as e:
+                log_error(f"Coordinator reap error: {e}\n{traceback.format_exc()}")
+
+    def reap(self):
+        """Hand the tasks of expired leases out again"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [lease for lease in self.leases.values() if lease.expires < now]
+            for lease in expired:
+                del self.leases[lease.lease_id]
+        for lease in expired:
+            self.job.work_queue.release(list(lease.tasks.values()))
+            self.log(f"Lease of {lease.worker} expired, {len(lease.tasks)} tasks handed out again")
+
+    def progress(self):
+        work_queue = self.job.work_queue
+        now = time.monotonic()
+        with self.lock:
+            leased = sum(len(lease.tasks) for lease in self.leases.values())
+            workers = {
+                name: {"lookups": worker.done, "seen_ago": round(now - self.last_seen[name], 1)}
+                for name, worker in self.workers.items()
+            }
+        elapsed = now - self.started
+        return {
+            "total": work_queue.total,
+            "finished": work_queue.finished,
+            "leased": leased,
+            "per_second": round(work_queue.finished / elapsed, 2) if elapsed else 0.0,
+            "outcomes": self.job.rate.snapshot() if self.job.rate else {},
+            "workers": workers,
+        }
+
+    def is_done(self):
+        return self.job.work_queue.is_done()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    """JSON API: GET /config, GET /progress, POST /lease {worker, n}, POST /results {worker, leases}"""
+
+    def do_GET(self):
+        coordinator = self.server.coordinator
+        if not self.authorized():
+            return
+        if self.path == "/config":
+            self.reply(200, coordinator.config())
+        elif self.path == "/progress":
+            self.reply(200, coordinator.progress())
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        if not self.authorized():
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/lease":
+                self.reply(200, coordinator.lease(str(body["worker"]), int(body.get("n", 1))))
+            elif self.path == "/results":
+                self.reply(200, coordinator.submit(str(body["worker"]), body.get("leases", {}),
+                                                   bool(body.get("release"))))
+            else:
+                self.reply(404, {"error": "not found"})
+        except (KeyError, TypeError, ValueError) as e:
+            self.reply(400, {"error": f"bad request: {e}"})
+        except Exception as e:
+            log_error(f"Coordinator {self.path} error: {e}\n{traceback.format_exc()}")
+            self.reply(500, {"error": str(e)})
+
+    def authorized(self):
+        token = self.server.token
+        if token and self.headers.get(TOKEN_HEADER) != token:
+            self.reply(403, {"error": "wrong or missing token"})
+            return False
+        return True
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def is_loopback(host):
+    """Whether only this machine can reach an address"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class CoordinatorServer(ThreadingHTTPServer):
+    """Serves the coordinator; listening beyond this machine requires a token"""
+
+    daemon_threads = True
+
+    def __init__(self, coordinator, host="127.0.0.1", port=DEFAULT_PORT, token=None):
+        if not token and not is_loopback(host):
+            raise ValueError(f"a token is required to listen on {host}")
+        super().__init__((host, port), CoordinatorHandler)
+        self.coordinator = coordinator
+        self.token = token
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="coordinator-server", daemon=True).start()
+        return self
+
+
+class CoordinatorUnavailable(Exception):
+    """Raised when the coordinator cannot be reached"""
+
+
+class ClientMixin:
+    """Report results to the coordinator; metrics, progress and log lines stay local"""
+
+    def handle_success(self, task, lyrics, latency):
+        self.client.submit(task, lyrics, None, latency)
+        self.report(task)
+
+    def handle_failure(self, task, error, latency):
+        _, artist, track_name, _ = task
+        self.client.submit(task, None, error, latency)
+        self.log(f"Error processing {artist} - {track_name}, reported to the coordinator: {error}")
+
+
+class ClientWorker(ClientMixin, LookupWorker):
+    def __init__(self, worker_id, client, on_progress=None, on_log=None):
+        super().__init__(worker_id, client.work_queue, client.lang, None, client.engine_name, client.http_engine,
+                         client.driver_pool, rate=client.rate, on_progress=on_progress, on_log=on_log,
+                         base_url=client.base_url)
+        self.client = client
+
+
+class ClientAsyncWorker(ClientMixin, AsyncLookupWorker):
+    def __init__(self, worker_id, client, on_progress=None, on_log=None):
+        super().__init__(worker_id, client.work_queue, client.lang, None, client.max_workers, rate=client.rate,
+                         on_progress=on_progress, on_log=on_log, base_url=client.base_url,
+                         sources=client.sources, parallel_sources=client.parallel_sources)
+        self.client = client
+
+
+class ClientTasks(RemoteTasks):
+    """Tasks leased from the coordinator; total and finished are the coordinator's, for progress displays"""
+
+    def __init__(self, tasks, stop):
+        super().__init__(tasks, stop)
+        self.total = 0
+        self.finished = 0
+
+    def next_ready_in(self):
+        # The async worker waits this long before asking again while more tasks are on the way
+        return None if self.is_done() else 0.2
+
+
+class WorkerClient:
+    """Crawl for a Coordinator: lease tasks over HTTP, look them up here and post the results back.
+
+    Offers the parts of worker.CrawlJob used by the GUI and cli.py (open, create_workers,
+    work_queue, rate, stop, close, summary), so both can run as a worker of a distributed crawl.
+    The language, search engine URL and lyrics sources come from the coordinator; the engine,
+    number of workers and request rate are this machine's.
+    """
+
+    FLUSH_INTERVAL = 1.0  # Seconds between result posts, which also renew the leases
+    MAX_OFFLINE = 120  # Seconds without reaching the coordinator before giving up
+
+    def __init__(self, url, engine_name="http", max_workers=5, max_rate=5.0, name=None, token=None):
+        self.url = url.rstrip("/")
+        self.engine_name = engine_name
+        self.max_workers = max(max_workers, 1)
+        self.max_rate = max(max_rate, 0.2)
+        self.name = name or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.token = token
+        self.lang = None
+        self.base_url = GOOGLE_URL
+        self.sources = None
+        self.parallel_sources = False
+        self.total_rows = self.pending_rows = self.pending_keys = 0
+        self.rewritten_rows = 0  # The coordinator keeps the output
+        self.lease_seconds = 120  # Replaced by the coordinator's setting in open()
+        self.http_engine = None
+        self.driver_pool = None
+        self.rate = None
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.stopping = threading.Event()
+        self.work_queue = ClientTasks(self.tasks, self.stopping)
+        self.outstanding = {}  # Task key -> lease id, for tasks received and not reported yet
+        self.lock = threading.Lock()
+        self.threads = []
+        self.offline_since = None
+
+    def call(self, method, path, payload=None):
+        """Send one request to the coordinator and return the decoded reply"""
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = Request(self.url + path, data=data, method=method, headers={"Content-Type": "application/json"})
+        if self.token:
+            request.add_header(TOKEN_HEADER, self.token)
+        try:
+            with urlopen(request, timeout=30) as response:
+                reply = json.loads(response.read())
+        except HTTPError as e:
+            raise CoordinatorUnavailable(f"{path}: HTTP {e.code} {e.read().decode('utf-8', 'replace')}") from e
+        except (URLError, OSError, ValueError) as e:
+            raise CoordinatorUnavailable(f"{path}: {e}") from e
+        if "progress" in reply:
+            self.work_queue.total = reply["progress"]["total"]
+            self.work_queue.finished = reply["progress"]["finished"]
+        return reply
+
+    def open(self):
+        """Fetch the crawl settings from the coordinator, start the engines and the lease/report threads"""
+        config = self.call("GET", "/config")
+        METRICS.reset()
+        self.lang = config["lang"]
+        self.base_url = config["base_url"]
+        self.sources = config["sources"]
+        self.parallel_sources = config["parallel_sources"]
+        self.total_rows = config["total_rows"]
+        self.pending_rows = config["pending_rows"]
+        self.pending_keys = config["pending_keys"]
+        self.lease_seconds = config["lease_seconds"]
+        self.rate = RateController(self.max_rate, concurrency=min(self.max_workers, 10),
+                                   max_concurrency=self.max_workers)
+        if self.engine_name in ("http", "auto"):
+            self.http_engine = HttpEngine(self.lang, self.base_url, pool_size=self.max_workers,
+                                          sources=self.sources, parallel_sources=self.parallel_sources,
+                                          rate=self.rate)
+        if self.engine_name in BROWSER_ENGINES:
+            self.driver_pool = DriverPool(self.max_workers, fast=self.engine_name == "headless")
+            if self.engine_name != "auto":
+                self.driver_pool.start()
+        self.threads = [
+            threading.Thread(target=self.lease_loop, name="client-lease", daemon=True),
+            threading.Thread(target=self.report_loop, name="client-report", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def create_workers(self, on_progress=None, on_log=None):
+        if self.engine_name == "async":
+            return [ClientAsyncWorker(0, self, on_progress, on_log)]
+        return [ClientWorker(i, self, on_progress, on_log) for i in range(self.max_workers)]
+
+    def offline(self, error):
+        """Note a failed request; returns True once the coordinator has been unreachable for too long"""
+        now = time.monotonic()
+        if self.offline_since is None:
+            self.offline_since = now
+            log_error(f"WorkerClient {self.name} cannot reach {self.url}: {error}")
+        return now - self.offline_since > self.MAX_OFFLINE
+
+    def lease_loop(self):
+        """Keep one to two tasks per worker queued here, leasing more once the queue runs low"""
+        prefetch = self.max_workers * 2
+        try:
+            while not self.stopping.is_set():
+                queued = self.tasks.qsize()
+                if queued > self.max_workers:
+                    time.sleep(0.05)
+                    continue
+                wanted = prefetch - queued
+                try:
+                    reply = self.call("POST", "/lease", {"worker": self.name, "n": wanted})
+                    self.offline_since = None
+                except CoordinatorUnavailable as e:
+                    if self.offline(e):
+                        break
+                    time.sleep(2)
+                    continue
+                if reply["tasks"]:
+                    with self.lock:
+                        for key, artist, track_name, rows in reply["tasks"]:
+                            self.outstanding[key] = reply["lease"]
+                    for key, artist, track_name, rows in reply["tasks"]:
+                        self.tasks.put((key, artist, track_name, [tuple(row) for row in rows]))
+                elif reply["done"]:
+                    break
+                else:
+                    time.sleep(reply.get("retry_after", 1.0))
+        except Exception as e:
+            log_error(f"WorkerClient lease error: {e}\n{traceback.format_exc()}")
+        finally:
+            self.tasks.put(None)
+
+    def submit(self, task, lyrics, error, latency):
+        """Queue a result for the next post to the coordinator"""
+        outcome = classify(lyrics, error) if error else None
+        source = getattr(lyrics, "source", None)
+        self.results.put((task[0], lyrics, outcome, str(error) if error else "", latency, source))
+
+    def report_loop(self):
+        """Post queued results every FLUSH_INTERVAL; each post also renews every lease still held.
+
+        Once the client stops and every result is posted, the leases left are handed back.
+        """
+        while True:
+            stopping = self.stopping.is_set()
+            results = []
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            while len(results) < 500:
+                try:
+                    results.append(self.results.get(timeout=max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    break
+            final = stopping and self.results.empty()
+            if not self.post(results, release=final) or final:
+                return
+
+    def post(self, results, release=False):
+        """Post results; returns False once the coordinator has been unreachable for MAX_OFFLINE"""
+        with self.lock:
+            leases = {lease_id: [] for lease_id in self.outstanding.values()}
+            sent = []  # (task key, lease id) of each result in this post
+            for result in results:
+                lease_id = self.outstanding.get(result[0])
+                if lease_id is not None:
+                    leases[lease_id].append(list(result))
+                    sent.append((result[0], lease_id))
+        if not leases:
+            return True
+        try:
+            reply = self.call("POST", "/results", {"worker": self.name, "leases": leases, "release": release})
+            self.offline_since = None
+        except CoordinatorUnavailable as e:
+            # Sent again with the next post; if the coordinator stays away the leases expire there
+            for result in results:
+                self.results.put(result)
+            if self.offline(e):
+                self.stopping.set()
+                return False
+            time.sleep(1)
+            return True
+        expired = set(reply["expired"])
+        with self.lock:
+            for key, lease_id in sent:
+                # A failed task can already be leased to us again under a new lease, which stays outstanding
+                if self.outstanding.get(key) == lease_id:
+                    del self.outstanding[key]
+            for key, lease_id in list(self.outstanding.items()):
+                if lease_id in expired:
+                    del self.outstanding[key]
+        if expired:
+            log_error(f"WorkerClient {self.name}: {len(expired)} leases expired, their results were refused")
+        return True
+
+    def stop(self):
+        self.stopping.set()
+        if self.rate:
+            self.rate.stop()
+
+    def close_engines(self):
+        try:
+            if self.http_engine:
+                self.http_engine.close()
+                self.http_engine = None
+            if self.driver_pool:
+                self.driver_pool.close()
+                self.driver_pool = None
+        except Exception as e:
+            log_error(f"WorkerClient close_engines error: {e}\n{traceback.format_exc()}")
+
+    def close(self):
+        """Stop leasing, post the remaining results and close the engines"""
+        self.close_engines()
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def summary(self):
+        return METRICS.summary_text()
@@ -1,170 +1,117 @@
 import os
 import sys
+import time
 import multiprocessing
-import pandas as pd
 import traceback
+from collections import deque
 
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton, QFileDialog, QLabel,
-    QLineEdit, QTextEdit, QProgressBar, QHBoxLayout, QGridLayout, QScrollArea,
+    QLineEdit, QPlainTextEdit, QProgressBar, QHBoxLayout, QGridLayout, QScrollArea,
     QMessageBox, QComboBox
 )
-from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtCore import QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QGuiApplication
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait as wait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 
+from engines import ENGINES
+from export import export_dataset
+from logs import LOG_PATH, log_error, stop_logging
+from output import ARCHIVE, DEDUP, TREE
+from store import state_path_for
+from worker import CrawlJob
 
-def log_error(error_msg: str):
-    """Log error messages to error_log.txt"""
-    with open("error_log.txt", "a", encoding="utf-8") as f:
-        f.write(error_msg + "\n")
 
+def format_eta(seconds):
+    if seconds >= 3600:
+        return f"{int(seconds // 3600)}h {int(seconds % 3600 // 60):02d}m"
+    return f"{int(seconds // 60)}m {int(seconds % 60):02d}s"
 
-def sanitize_filename(name):
-    """Remove illegal characters to ensure filename validity"""
-    try:
-        return "".join(c for c in name if c.isalnum() or c in (" ", "-", "_")).rstrip()
-    except Exception as e:
-        log_error(f"sanitize_filename error: {e}\n{traceback.format_exc()}")
-        return "unknown"
 
+class Throughput:
+    """Items per second over the last `window` seconds, from a running count sampled by the GUI timer"""
 
-def setup_driver():
-    try:
-        options = Options()
-        options.add_experimental_option("detach", True)
-        options.add_experimental_option("prefs", {
-            "profile.default_content_setting_values.notifications": 1,
-            "profile.managed_default_content_settings.images": 2
-        })
-        options.add_argument("--disable-infobars")
-        options.page_load_strategy = 'eager'
-        options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        options.add_argument("--remote-allow-origins=*")
-        options.add_argument("--disable-blink-features=AutomationControlled")
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
-        return driver
-    except Exception as e:
-        log_error(f"setup_driver error: {e}\n{traceback.format_exc()}")
-        raise
+    def __init__(self, window=10.0):
+        self.window = window
+        self.samples = deque()
+
+    def update(self, count, now):
+        self.samples.append((now, count))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        started, first = self.samples[0]
+        return (count - first) / (now - started) if now > started else 0.0
 
 
 class ScraperWorker(QThread):
-    progress_signal = pyqtSignal(int, int, int)  # worker_id, done, total
-    log_signal = pyqtSignal(int, str)             # worker_id, log message
-    finished_signal = pyqtSignal(int)
+    """Run a worker.LookupWorker on a Qt thread.
 
-    SAVE_THRESHOLD = 10000  # Save data every 10,000 records
+    Log lines go into a deque shared with the GUI instead of one signal per row; deque appends are
+    atomic, so workers never wait on a lock or on the event loop. The GUI reads core.done for progress.
+    """
+
+    finished_signal = pyqtSignal(int)
 
-    def __init__(self, worker_id, batch, lang):
+    def __init__(self, core, log_buffer):
         super().__init__()
-        self.worker_id = worker_id
-        self.batch = batch
-        self.lang = lang  # Official language: "English" or "Chinese"
-        self.lyrics_list = []
-        self.total = len(batch)
-        self.done = 0
-        self.lyrics_dir = "lyrics"
-        self.driver = None
-        self._is_running = True  # Control thread running state
+        self.core = core
+        self.worker_id = core.worker_id
+        self.log_buffer = log_buffer
+        core.on_log = self.log
+
+    def log(self, worker_id, message):
+        self.log_buffer.append((worker_id, message))
 
     def run(self):
         try:
-            self.driver = setup_driver()
-            os.makedirs(self.lyrics_dir, exist_ok=True)
-
-            # Determine the split string based on selected language
-            lang_split = "Translate to English" if self.lang.lower() == "english" else "翻译成中文"
-
-            for idx, row in self.batch.iterrows():
-                if not self._is_running:
-                    self.log_signal.emit(self.worker_id, "Exit request received, terminating scraping early.")
-                    break
-
-                try:
-                    artist, track_name = row['artists'], row['track_name']
-                    search_query = f"{artist} {track_name} lyrics"
-                    self.driver.get("https://www.google.com/")
-
-                    lyrics = "Not Found"
-                    try:
-                        element = wait(self.driver, 3).until(
-                            EC.visibility_of_element_located((By.NAME, 'q'))
-                        )
-                        element.send_keys(search_query, Keys.ENTER)
-                        lyrics_elem = wait(self.driver, 3).until(
-                            EC.presence_of_element_located((By.XPATH, '//div[@data-attrid="kc:/music/recording_cluster:lyrics"]'))
-                        )
-                        if lyrics_elem.text:
-                            # Split the text based on the chosen language
-                            lyrics = lyrics_elem.text.split(lang_split)[0]
-                    except Exception as e:
-                        self.log_signal.emit(self.worker_id, f"Error processing {artist} - {track_name}: {e}")
-
-                    self.lyrics_list.append((artist, track_name, lyrics))
-                    self.done += 1
-                    self.progress_signal.emit(self.worker_id, self.done, self.total)
-                    self.log_signal.emit(self.worker_id, f"Processed {self.done}/{self.total} - {artist} - {track_name}")
-
-                    # Save data every SAVE_THRESHOLD records
-                    if self.done % self.SAVE_THRESHOLD == 0:
-                        self.save_lyrics()
-                except Exception as inner_e:
-                    self.log_signal.emit(self.worker_id, f"Loop error: {inner_e}")
-                    log_error(f"Worker {self.worker_id} loop error: {inner_e}\n{traceback.format_exc()}")
-
-            # Save any remaining data
-            self.save_lyrics()
-            self.batch['lyrics'] = [lyr[2] for lyr in self.lyrics_list]
-        except Exception as e:
-            self.log_signal.emit(self.worker_id, f"Run error: {e}")
-            log_error(f"Worker {self.worker_id} run error: {e}\n{traceback.format_exc()}")
+            self.core.run()
         finally:
-            self.cleanup()
             self.finished_signal.emit(self.worker_id)
 
-    def save_lyrics(self):
-        try:
-            for artist, track_name, lyrics in self.lyrics_list:
-                artist_dir = os.path.join(self.lyrics_dir, sanitize_filename(artist))
-                os.makedirs(artist_dir, exist_ok=True)
-                lyrics_file = os.path.join(artist_dir, sanitize_filename(track_name) + ".txt")
-                if not os.path.exists(lyrics_file):
-                    with open(lyrics_file, "w", encoding="utf-8") as f:
-                        f.write(lyrics)
-            self.log_signal.emit(self.worker_id, f"Saved {self.done} lyrics so far.")
-        except Exception as e:
-            self.log_signal.emit(self.worker_id, f"save_lyrics error: {e}")
-            log_error(f"Worker {self.worker_id} save_lyrics error: {e}\n{traceback.format_exc()}")
+    def stop(self):
+        """Notify the thread to exit early"""
+        self.core.stop()
+
 
-    def cleanup(self):
+class ExportWorker(QThread):
+    """Run export.export_dataset off the GUI thread; emits a message for the user when done"""
+
+    finished_signal = pyqtSignal(str)
+
+    def __init__(self, input_path, output_path):
+        super().__init__()
+        self.input_path = input_path
+        self.output_path = output_path
+
+    def run(self):
         try:
-            if self.driver:
-                self.driver.quit()
-                self.driver = None
+            counts = export_dataset(self.input_path, state_path_for(self.input_path), self.output_path)
+            message = (f"Exported {sum(counts.values())} rows to {self.output_path}: "
+                       + ", ".join(f"{status} {count}" for status, count in sorted(counts.items())))
         except Exception as e:
-            log_error(f"Worker {self.worker_id} cleanup error: {e}\n{traceback.format_exc()}")
-
-    def stop(self):
-        """Notify the thread to exit early"""
-        self._is_running = False
+            log_error(f"Export error: {e}\n{traceback.format_exc()}", stage="export")
+            message = f"Export failed: {e}"
+        self.finished_signal.emit(message)
 
 
 class LyricsScraperGUI(QWidget):
+    # Same order as engines.ENGINES, followed by the asyncio mode
+    ENGINE_LABELS = ("Chrome", "HTTP", "HTTP + Chrome fallback", "Headless Chrome (fast)", "Async HTTP")
+    REFRESH_MS = 250  # The progress panel is redrawn at this interval, however fast rows finish
+    LOG_LINES = 500  # Lines kept in each worker's log view
+    LOG_BUFFER = 20000  # Undrained log lines kept between two refreshes; the oldest are dropped
+
     def __init__(self):
         super().__init__()
         self.workers = []
         self.worker_widgets = {}
         self.total_workers = 0
         self.completed_workers = 0
+        self.job = None  # worker.CrawlJob of the current run
+        self.exporter = None  # ExportWorker while an export runs
+        self.log_buffer = deque(maxlen=self.LOG_BUFFER)  # (worker_id, message) from every worker
+        self.overall_throughput = Throughput()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh_progress)
         self.initUI()
 
     def initUI(self):
@@ -189,10 +136,26 @@ class LyricsScraperGUI(QWidget):
             file_layout.addWidget(self.browse_button)
             layout.addLayout(file_layout)
 
+            # Work for a coordinator (python cli.py coordinate) instead of crawling a CSV here
+            self.coordinator_input = QLineEdit(self)
+            self.coordinator_input.setPlaceholderText("Optional, e.g. http://192.168.1.10:8700")
+            layout.addWidget(QLabel("Coordinator URL:"))
+            layout.addWidget(self.coordinator_input)
+
             self.max_workers_input = QLineEdit("5", self)
             layout.addWidget(QLabel("Max Workers:"))
             layout.addWidget(self.max_workers_input)
 
+            # Worker processes split the workers between them so the engines can use several CPU cores
+            self.processes_input = QLineEdit("1", self)
+            layout.addWidget(QLabel("Processes:"))
+            layout.addWidget(self.processes_input)
+
+            # Upper bound on the request rate; the rate controller backs off below it when blocked
+            self.rate_input = QLineEdit("5", self)
+            layout.addWidget(QLabel("Max Requests per Second:"))
+            layout.addWidget(self.rate_input)
+
             # Language selection dropdown
             self.language_selector = QComboBox(self)
             self.language_selector.addItem("Chinese")
@@ -200,9 +163,37 @@ class LyricsScraperGUI(QWidget):
             layout.addWidget(QLabel("Official Language:"))
             layout.addWidget(self.language_selector)
 
+            # Extraction engine: Chrome, browserless HTTP, HTTP with Chrome fallback, or headless Chrome
+            self.engine_selector = QComboBox(self)
+            for label, name in zip(self.ENGINE_LABELS, ENGINES + ("async",)):
+                self.engine_selector.addItem(label, name)
+            layout.addWidget(QLabel("Engine:"))
+            layout.addWidget(self.engine_selector)
+
+            # Lyrics sources asked by the HTTP engines, highest priority first
+            self.sources_selector = QComboBox(self)
+            self.sources_selector.addItem("Google", ["google"])
+            self.sources_selector.addItem("Google, then lyrics.ovh", ["google", "lyrics.ovh"])
+            layout.addWidget(QLabel("Lyrics Sources:"))
+            layout.addWidget(self.sources_selector)
+
+            # Output backend: one file per song, or packed segment files with an index
+            self.output_selector = QComboBox(self)
+            self.output_selector.addItem("Folder tree (lyrics/)", TREE)
+            self.output_selector.addItem("Packed archive (lyrics.archive/)", ARCHIVE)
+            self.output_selector.addItem("Deduplicated archive (lyrics.dedup/)", DEDUP)
+            layout.addWidget(QLabel("Output:"))
+            layout.addWidget(self.output_selector)
+
             self.worker_grid = QGridLayout()
             self.worker_widgets = {}
 
+            self.overall_progress = QProgressBar(self)
+            layout.addWidget(QLabel("Overall Progress:"))
+            layout.addWidget(self.overall_progress)
+            self.rate_label = QLabel("", self)
+            layout.addWidget(self.rate_label)
+
             scroll_area = QScrollArea()
             scroll_widget = QWidget()
             scroll_widget.setLayout(self.worker_grid)
@@ -214,6 +205,11 @@ class LyricsScraperGUI(QWidget):
             self.start_button.clicked.connect(self.start_scraping)
             layout.addWidget(self.start_button)
 
+            # The selected CSV with the lyrics found so far added as columns
+            self.export_button = QPushButton("Export Dataset with Lyrics", self)
+            self.export_button.clicked.connect(self.export_dataset)
+            layout.addWidget(self.export_button)
+
             self.setLayout(layout)
         except Exception as e:
             log_error(f"initUI error: {e}\n{traceback.format_exc()}")
@@ -228,6 +224,36 @@ class LyricsScraperGUI(QWidget):
             log_error(f"select_file error: {e}\n{traceback.format_exc()}")
             QMessageBox.critical(self, "Error", f"Error selecting file: {e}")
 
+    def export_dataset(self):
+        try:
+            input_path = self.file_input.text()
+            if not input_path:
+                QMessageBox.warning(self, "Warning", "Please select a CSV file first.")
+                return
+            if not os.path.exists(state_path_for(input_path)):
+                QMessageBox.warning(self, "Warning", "This CSV file has not been scraped yet.")
+                return
+            default = os.path.splitext(input_path)[0] + "_lyrics.csv"
+            filename, _ = QFileDialog.getSaveFileName(
+                self, "Export Dataset", default, "CSV files (*.csv);;Parquet files (*.parquet);;Feather files (*.feather)"
+            )
+            if not filename:
+                return
+            self.export_button.setEnabled(False)
+            self.export_button.setText("Exporting...")
+            self.exporter = ExportWorker(input_path, filename)
+            self.exporter.finished_signal.connect(self.export_finished)
+            self.exporter.start()
+        except Exception as e:
+            log_error(f"export_dataset error: {e}\n{traceback.format_exc()}")
+            QMessageBox.critical(self, "Error", f"Error exporting dataset: {e}")
+
+    def export_finished(self, message):
+        self.export_button.setEnabled(True)
+        self.export_button.setText("Export Dataset with Lyrics")
+        self.exporter = None
+        QMessageBox.information(self, "Export", message)
+
     def clear_worker_grid(self):
         """Clear the progress panel (grid layout) from previous tasks."""
         try:
@@ -241,15 +267,21 @@ class LyricsScraperGUI(QWidget):
 
     def start_scraping(self):
         try:
+            if any(worker.isRunning() for worker in self.workers):
+                # close_job below would close the job store and writer under the running workers
+                return
             # Reset previous task's progress panel and internal state
             self.clear_worker_grid()
             self.workers = []
             self.worker_widgets = {}
             self.total_workers = 0
             self.completed_workers = 0
+            self.log_buffer.clear()
+            self.overall_throughput = Throughput()
 
             input_path = self.file_input.text()
-            if not input_path:
+            coordinator_url = self.coordinator_input.text().strip()
+            if not input_path and not coordinator_url:
                 QMessageBox.warning(self, "Warning", "Please select a CSV file first.")
                 return
 
@@ -258,65 +290,142 @@ class LyricsScraperGUI(QWidget):
             except ValueError:
                 max_workers = 5
 
-            # Get the selected language from the dropdown
-            selected_language = self.language_selector.currentText()
+            try:
+                max_rate = float(self.rate_input.text())
+            except ValueError:
+                max_rate = 5.0
 
-            df = pd.read_csv(input_path)
-            batch_size = len(df) // max_workers if max_workers > 0 else len(df)
-            batches = [df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size)]
+            try:
+                processes = int(self.processes_input.text())
+            except ValueError:
+                processes = 1
 
-            self.total_workers = len(batches)
+            # Get the selected language from the dropdown
+            selected_language = self.language_selector.currentText()
+            engine_name = self.engine_selector.currentData()
+            self.start_button.setEnabled(False)
+            self.start_button.setText("Scraping...")
+            self.close_job()
+            if coordinator_url:
+                # Language, sources and output are the coordinator's; only the engine and pace are ours
+                from coordinator import WorkerClient
+
+                self.job = WorkerClient(coordinator_url, engine_name, max_workers, max_rate)
+            else:
+                self.job = CrawlJob(input_path, selected_language, engine_name, max_workers, max_rate,
+                                    self.output_selector.currentData(), processes=processes,
+                                    sources=self.sources_selector.currentData())
+            self.job.open()
+            resumed = self.job.total_rows - self.job.pending_rows
+            self.overall_progress.setValue(0)
+            self.overall_progress.resetFormat()
+            cores = self.job.create_workers()
+            worker_count = len(cores)
+
+            self.total_workers = worker_count
             self.completed_workers = 0
 
-            for i, batch in enumerate(batches):
+            for i in range(worker_count):
                 progress_bar = QProgressBar()
-                progress_label = QLabel("0/0")
-                log_box = QTextEdit()
+                progress_bar.setFormat("%p% of lookups")
+                progress_label = QLabel("0 lookups")
+                log_box = QPlainTextEdit()
                 log_box.setReadOnly(True)
+                log_box.setMaximumBlockCount(self.LOG_LINES)
 
                 self.worker_grid.addWidget(QLabel(f"Worker {i+1}"), i, 0)
                 self.worker_grid.addWidget(progress_bar, i, 1)
                 self.worker_grid.addWidget(progress_label, i, 2)
                 self.worker_grid.addWidget(log_box, i, 3)
 
-                self.worker_widgets[i] = (progress_bar, progress_label, log_box)
+                self.worker_widgets[i] = (progress_bar, progress_label, log_box, Throughput())
 
-                # Pass the selected language to each worker
-                worker = ScraperWorker(i, batch, selected_language)
-                worker.progress_signal.connect(self.update_worker_progress)
-                worker.log_signal.connect(self.update_worker_log)
+                worker = ScraperWorker(cores[i], self.log_buffer)
                 worker.finished_signal.connect(self.worker_finished)
                 worker.start()
                 self.workers.append(worker)
+
+            if resumed:
+                self.update_worker_log(0, f"Resuming: {resumed} of {self.job.total_rows} rows were already done.")
+            if self.job.rewritten_rows:
+                self.update_worker_log(0, f"Output changed: {self.job.rewritten_rows} rows done by earlier runs "
+                                          f"were written to it.")
+            self.update_worker_log(0, f"{self.job.pending_rows} rows collapsed into {self.job.pending_keys} lookups.")
+            self.refresh_timer.start(self.REFRESH_MS)
         except Exception as e:
             log_error(f"start_scraping error: {e}\n{traceback.format_exc()}")
+            if not any(worker.isRunning() for worker in self.workers):
+                self.reset_start_button()
             QMessageBox.critical(self, "Error", f"Error starting scraping task: {e}")
 
-    def update_worker_progress(self, worker_id, done, total):
+    def refresh_progress(self):
+        """Drain the buffered log lines and redraw the progress panel; called by refresh_timer"""
         try:
-            if worker_id in self.worker_widgets:
-                progress_bar, progress_label, _ = self.worker_widgets[worker_id]
-                progress_bar.setValue(int((done / total) * 100))
-                progress_label.setText(f"{done}/{total}")
+            now = time.monotonic()
+            lines = {}
+            for _ in range(len(self.log_buffer)):
+                worker_id, message = self.log_buffer.popleft()
+                lines.setdefault(worker_id, []).append(message)
+            for worker_id, messages in lines.items():
+                if worker_id in self.worker_widgets:
+                    # One append per view and tick; older lines would be trimmed straight away anyway
+                    self.worker_widgets[worker_id][2].appendPlainText("\n".join(messages[-self.LOG_LINES:]))
+
+            # Workers share one queue, so a worker's bar shows its share of the lookups finished here
+            finished_here = sum(worker.core.done for worker in self.workers)
+            for worker in self.workers:
+                progress_bar, progress_label, _, throughput = self.worker_widgets[worker.worker_id]
+                done = worker.core.done
+                progress_bar.setValue(int((done / finished_here) * 100) if finished_here else 0)
+                progress_label.setText(f"{done} lookups, {throughput.update(done, now):.1f}/s")
+
+            work_queue = self.job.work_queue if self.job else None
+            if work_queue and work_queue.total:
+                finished, total = work_queue.finished, work_queue.total
+                per_second = self.overall_throughput.update(finished, now)
+                eta = f", ETA {format_eta((total - finished) / per_second)}" if per_second and finished < total else ""
+                self.overall_progress.setValue(int((finished / total) * 100))
+                self.overall_progress.setFormat(f"%p% ({finished}/{total}, {per_second:.1f}/s{eta})")
+            if self.job and self.job.rate:
+                stats = self.job.rate.snapshot()
+                paused = f", paused {stats['paused_for']:.0f}s" if stats["paused_for"] else ""
+                self.rate_label.setText(
+                    f"Concurrency {stats['concurrency']}, {stats['rate']} req/s{paused} | found {stats['found']}, "
+                    f"no lyrics {stats['no_panel']}, blocked {stats['blocked']}, timeouts {stats['timeout']}, "
+                    f"errors {stats['error']}"
+                )
         except Exception as e:
-            log_error(f"update_worker_progress error: {e}\n{traceback.format_exc()}")
+            log_error(f"refresh_progress error: {e}\n{traceback.format_exc()}")
 
     def update_worker_log(self, worker_id, message):
-        try:
-            if worker_id in self.worker_widgets:
-                _, _, log_box = self.worker_widgets[worker_id]
-                log_box.append(message)
-        except Exception as e:
-            log_error(f"update_worker_log error: {e}\n{traceback.format_exc()}")
+        """Queue a log line for a worker's view; it is shown on the next refresh"""
+        self.log_buffer.append((worker_id, message))
 
     def worker_finished(self, worker_id):
         try:
             self.completed_workers += 1
             if self.completed_workers == self.total_workers:
+                self.refresh_progress()
+                self.refresh_timer.stop()
+                job = self.job
+                self.close_job()
+                self.reset_start_button()
+                if job and 0 in self.worker_widgets:
+                    self.worker_widgets[0][2].appendPlainText(job.summary())
                 QMessageBox.information(self, "Task Completed", "All lyrics have been scraped and saved!")
         except Exception as e:
             log_error(f"worker_finished error: {e}\n{traceback.format_exc()}")
 
+    def reset_start_button(self):
+        self.start_button.setEnabled(True)
+        self.start_button.setText("Start Scraping")
+
+    def close_job(self):
+        """Close the engines, writer, output, job store and cache of the current run"""
+        if self.job:
+            self.job.close()
+            self.job = None
+
     def closeEvent(self, event):
         """When exiting the program: notify all threads to stop, save any unsaved data, then exit."""
         try:
@@ -326,6 +435,8 @@ class LyricsScraperGUI(QWidget):
             )
             if reply == QMessageBox.StandardButton.Yes:
                 # Notify all worker threads to stop running
+                if self.job:
+                    self.job.stop()
                 for worker in self.workers:
                     if worker.isRunning():
                         worker.stop()
@@ -333,17 +444,20 @@ class LyricsScraperGUI(QWidget):
                 for worker in self.workers:
                     worker.quit()
                     worker.wait()
+                self.close_job()
 
                 # Optional: Close any remaining chromedriver processes (example for Windows)
                 os.system("taskkill /f /im/chromedriver.exe")
                 # For Linux/macOS, you can use: os.system("pkill -f chromedriver")
 
                 event.accept()
+                stop_logging()
                 os._exit(0)
             else:
                 event.ignore()
         except Exception as e:
             log_error(f"closeEvent error: {e}\n{traceback.format_exc()}")
+            stop_logging()
             os._exit(0)
 
 
@@ -355,11 +469,11 @@ if __name__ == "__main__":
         window.show()
         sys.exit(app.exec())
     except Exception as e:
-        error_message = f"An error occurred: {e}\n{traceback.format_exc()}"
-        # Write error log
-        with open("error_log.txt", "w", encoding="utf-8") as f:
-            f.write(error_message)
+        # Appended like every other error, so the log of the run that led up to it is kept
+        log_error(f"An error occurred: {e}\n{traceback.format_exc()}", stage="gui")
         # Show error message box
-        QMessageBox.critical(None, "Error", f"If you have any questions, please send error_log.txt to the developer.\n{e}")
+        QMessageBox.critical(None, "Error", f"If you have any questions, please send {LOG_PATH} to the developer.\n{e}")
     finally:
+        # os._exit skips atexit, so write out the queued log records first
+        stop_logging()
         os._exit(0)
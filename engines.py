@@ -0,0 +1,589 @@
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from urllib.parse import urlencode
+
+# requests, Selenium, webdriver_manager and psutil are imported where they are used, so a run
+# only loads the dependencies of the engine it picked
+from logs import LOG_PATH, log_error
+from metrics import METRICS
+from ratecontrol import BlockedError, classify, is_block_page
+
+
+GOOGLE_URL = "https://www.google.com"
+LYRICS_ATTRID = "kc:/music/recording_cluster:lyrics"
+LYRICS_XPATH = f'//div[@data-attrid="{LYRICS_ATTRID}"]'
+
+# Resolved chromedriver path, cached so ChromeDriverManager only runs once per machine
+DRIVER_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".lyrics_scraper", "chromedriver_path.txt")
+
+# Engine names accepted by create_engine()
+ENGINES = ("chrome", "http", "auto", "headless")
+# Engines that need a DriverPool; "headless" uses a pool of fast browsers (see setup_driver)
+BROWSER_ENGINES = ("chrome", "auto", "headless")
+
+# Requests the fast browsers never make: nothing but the results page's own HTML is needed
+BLOCKED_URL_PATTERNS = [
+    "*.css", "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.mp4", "*.webm", "*.mp3", "*.m4a",
+    "*googletagmanager.com*", "*google-analytics.com*", "*doubleclick.net*", "*googlesyndication.com*",
+    "*googleadservices.com*", "*youtube.com*", "*ytimg.com*", "*gstatic.com*",
+]
+
+# Polled on the results page until the lyrics node, the results list (no panel) or a CAPTCHA shows up.
+# A parsed page with results but no lyrics node definitely has no panel: it is part of the HTML.
+RESULTS_STATE_SCRIPT = """
+var lyrics = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (lyrics) return lyrics;
+if (document.getElementById("captcha-form") || location.pathname.indexOf("/sorry/") === 0) return "blocked";
+if (document.readyState !== "loading" && document.getElementById("search")) return "no_panel";
+return null;
+"""
+
+HTTP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+}
+# Pre-accepted cookie consent, so EU visitors get results instead of the consent interstitial
+HTTP_COOKIES = {"CONSENT": "YES+"}
+
+
+class Lyrics(str):
+    """Lyrics text that remembers the name of the source it came from, e.g. "google" or "lyrics.ovh".
+
+    Behaves as a plain str everywhere, so the source travels through workers, processes and the
+    writer into the job store without changing any lookup signature.
+    """
+
+    def __new__(cls, text, source=None):
+        lyrics = super().__new__(cls, text)
+        lyrics.source = source
+        return lyrics
+
+
+def lang_split_for(lang):
+    """Return the string that separates the original lyrics from the translation"""
+    return "Translate to English" if lang.lower() == "english" else "翻译成中文"
+
+
+def lang_code_for(lang):
+    """Return the Google interface language matching the official language"""
+    return "en" if lang.lower() == "english" else "zh-CN"
+
+
+def search_query_for(artist, track_name):
+    return f"{artist} {track_name} lyrics"
+
+
+def search_url(base_url, query, lang):
+    """Build the results page URL for a query"""
+    return f"{base_url.rstrip('/')}/search?" + urlencode({"q": query, "hl": lang_code_for(lang)})
+
+
+class LyricsBlockParser(HTMLParser):
+    """Collect the text of the lyrics knowledge panel from a results page"""
+
+    VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input",
+                 "link", "meta", "param", "source", "track", "wbr"}
+    BLOCK_TAGS = {"br", "div", "p", "li", "ul", "ol", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+    SKIP_TAGS = {"script", "style", "template"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0  # Nesting depth inside the lyrics block, 0 when outside
+        self.skip = 0
+        self.found = False
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.depth == 0:
+            if not self.found and tag == "div" and dict(attrs).get("data-attrid") == LYRICS_ATTRID:
+                self.found = True
+                self.depth = 1
+            return
+        if tag in self.SKIP_TAGS:
+            self.skip += 1
+        if tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        if tag not in self.VOID_TAGS:
+            self.depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self.depth and tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if self.depth == 0 or tag in self.VOID_TAGS:
+            return
+        if tag in self.SKIP_TAGS and self.skip:
+            self.skip -= 1
+        if tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        self.depth -= 1
+
+    def handle_data(self, data):
+        if self.depth and not self.skip:
+            self.parts.append(data)
+
+    def text(self):
+        """Return the block text with one line per rendered line, like WebElement.text"""
+        lines = [" ".join(line.split()) for line in "".join(self.parts).split("\n")]
+        return "\n".join(line for line in lines if line)
+
+
+def extract_lyrics_from_html(html, lang):
+    """Return the lyrics contained in a results page, or None if there is no lyrics block"""
+    parser = LyricsBlockParser()
+    parser.feed(html)
+    parser.close()
+    if not parser.found:
+        return None
+    text = parser.text()
+    return text.split(lang_split_for(lang))[0] if text else None
+
+
+_driver_path = None
+_driver_path_cached = False  # Whether _driver_path was read from DRIVER_CACHE_FILE
+_driver_path_lock = threading.Lock()
+
+
+def resolve_driver_path(stale=None):
+    """Return the chromedriver path, resolving it with ChromeDriverManager only if the cached one is gone.
+
+    stale is a path Chrome failed to launch with: if it came from the cache file, the file is deleted
+    and the path resolved again, e.g. after a Chrome update left the cached chromedriver behind.
+    """
+    global _driver_path, _driver_path_cached
+    with _driver_path_lock:
+        if stale and stale == _driver_path and _driver_path_cached:
+            _driver_path = None
+            try:
+                os.remove(DRIVER_CACHE_FILE)
+            except OSError:
+                pass
+        if _driver_path and os.path.exists(_driver_path):
+            return _driver_path
+        try:
+            with open(DRIVER_CACHE_FILE, encoding="utf-8") as f:
+                cached = f.read().strip()
+            if cached and os.path.exists(cached):
+                _driver_path = cached
+                _driver_path_cached = True
+                return _driver_path
+        except OSError:
+            pass
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        _driver_path = ChromeDriverManager().install()
+        _driver_path_cached = False
+        try:
+            os.makedirs(os.path.dirname(DRIVER_CACHE_FILE), exist_ok=True)
+            with open(DRIVER_CACHE_FILE, "w", encoding="utf-8") as f:
+                f.write(_driver_path)
+        except OSError as e:
+            log_error(f"resolve_driver_path cache write error: {e}")
+        return _driver_path
+
+
+def setup_driver(fast=False):
+    """Launch Chrome; fast browsers run headless and never load anything but HTML and scripts of the page"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+
+    try:
+        options = Options()
+        options.add_experimental_option("detach", True)
+        options.add_experimental_option("prefs", {
+            "profile.default_content_setting_values.notifications": 1,
+            "profile.managed_default_content_settings.images": 2
+        })
+        options.add_argument("--disable-infobars")
+        options.page_load_strategy = 'eager'
+        options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        options.add_argument("--remote-allow-origins=*")
+        options.add_argument("--disable-blink-features=AutomationControlled")
+        if fast:
+            options.add_argument("--headless=new")
+            options.add_argument("--window-size=1280,2000")
+            # The headless user agent says "HeadlessChrome", which Google answers with CAPTCHAs
+            options.add_argument(f"--user-agent={HTTP_HEADERS['User-Agent']}")
+        driver_path = resolve_driver_path()
+        try:
+            driver = webdriver.Chrome(service=Service(driver_path), options=options)
+        except Exception as e:
+            # Retry once if resolving again gives another chromedriver than the one that failed
+            fresh_path = resolve_driver_path(stale=driver_path)
+            if fresh_path == driver_path:
+                raise
+            log_error(f"setup_driver: {driver_path} failed, retrying with {fresh_path}: {e}")
+            driver = webdriver.Chrome(service=Service(fresh_path), options=options)
+        if fast:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+        return driver
+    except Exception as e:
+        log_error(f"setup_driver error: {e}\n{traceback.format_exc()}")
+        raise
+
+
+def driver_memory_mb(driver):
+    """Return the resident memory of chromedriver and its browser processes in MB"""
+    import psutil
+
+    try:
+        process = psutil.Process(driver.service.process.pid)
+        processes = [process] + process.children(recursive=True)
+        return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+    except (psutil.Error, AttributeError):
+        return 0
+
+
+def driver_is_healthy(driver):
+    try:
+        driver.current_window_handle
+        return True
+    except Exception:
+        return False
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+class DriverPool:
+    """Pre-launched Chrome instances leased to workers and recycled after max_pages or max_memory_mb.
+
+    Browsers that crash are replaced in the background instead of failing the worker.
+    A pool that was never started launches its browsers on the first lease.
+    With fast=True the browsers are headless and block fonts, stylesheets, media and trackers.
+    """
+
+    REPLACE_ATTEMPTS = 4  # Launches tried, with growing pauses, before a retired browser stays missing
+
+    def __init__(self, size, max_pages=200, max_memory_mb=1500, fast=False):
+        self.size = size
+        self.fast = fast
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.idle = queue.Queue()
+        self.live = 0  # Browsers idle, leased or being launched
+        self.lock = threading.Lock()
+        self.closed = False
+        self.started = False
+        self.executor = ThreadPoolExecutor(max_workers=max(size, 1), thread_name_prefix="driver-pool")
+
+    def start(self):
+        """Launch every browser in parallel without waiting for them; later calls do nothing"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            # Counted as launching from now on, so concurrent leases wait for them instead of failing
+            self.live += self.size
+        try:
+            resolve_driver_path()  # Resolve once before the parallel launches race for it
+        except Exception:
+            with self.lock:
+                self.live -= self.size
+            raise
+        for _ in range(self.size):
+            self.executor.submit(self._launch_one)
+
+    def _launch(self):
+        """Replace a retired browser; failed launches are retried so the pool does not shrink for good"""
+        with self.lock:
+            self.live += 1
+        self.executor.submit(self._launch_one, self.REPLACE_ATTEMPTS)
+
+    def _launch_one(self, attempts=1):
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+            if self.closed:
+                break
+            try:
+                with METRICS.timed("driver_start"):
+                    driver = setup_driver(self.fast)
+            except Exception:
+                continue
+            if self.closed:
+                driver.quit()
+                break
+            self.idle.put(PooledDriver(driver))
+            return
+        else:
+            if attempts > 1:
+                log_error(f"DriverPool: no browser could be launched in {attempts} attempts, "
+                          f"{self.live - 1} of {self.size} left")
+        with self.lock:
+            self.live -= 1
+
+    def _retire(self, pooled, replace=True):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            log_error(f"DriverPool quit error: {e}")
+        with self.lock:
+            self.live -= 1
+        if replace and not self.closed:
+            self._launch()
+
+    @contextmanager
+    def lease(self, timeout=120):
+        """Lease a browser for one page load; returns it to the pool or recycles it afterwards"""
+        if not self.started:
+            self.start()
+        pooled = None
+        waited = 0
+        started = time.perf_counter()
+        while pooled is None:
+            if self.closed:
+                raise RuntimeError("Driver pool is closed")
+            with self.lock:
+                if self.live == 0:
+                    raise RuntimeError(f"No browser could be started, see {LOG_PATH}")
+            try:
+                pooled = self.idle.get(timeout=1)
+            except queue.Empty:
+                waited += 1
+                if waited >= timeout:
+                    raise RuntimeError("Timed out waiting for a browser")
+        METRICS.observe("driver_wait", time.perf_counter() - started)
+        try:
+            yield pooled.driver
+        except Exception:
+            # A dead chromedriver mostly shows as a urllib3 or connection error, not a WebDriverException
+            if not driver_is_healthy(pooled.driver):
+                self._retire(pooled)
+                pooled = None
+            raise
+        finally:
+            if pooled is not None:
+                self.release(pooled)
+
+    def release(self, pooled):
+        pooled.pages += 1
+        if self.closed:
+            self._retire(pooled, replace=False)
+        elif pooled.pages >= self.max_pages:
+            self._retire(pooled)
+        elif self.max_memory_mb and pooled.pages % 10 == 0 and driver_memory_mb(pooled.driver) > self.max_memory_mb:
+            self._retire(pooled)
+        else:
+            self.idle.put(pooled)
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self._retire(self.idle.get_nowait(), replace=False)
+            except queue.Empty:
+                break
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class HttpEngine:
+    """Fetch results pages over a pooled keep-alive session and parse the lyrics block without a browser.
+
+    sources names the lyrics sources to ask, highest priority first (see sources.SourcePipeline);
+    by default only Google's results page. A single instance may be shared by several worker threads.
+    """
+
+    def __init__(self, lang, base_url=GOOGLE_URL, pool_size=10, timeout=5, sources=None, parallel_sources=False,
+                 rate=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        from sources import SourcePipeline, create_sources
+
+        self.lang = lang
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HTTP_HEADERS)
+        self.session.headers["Accept-Language"] = lang_code_for(lang)
+        self.session.cookies.update(HTTP_COOKIES)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pipeline = SourcePipeline(create_sources(sources, base_url), lang, parallel_sources, pool_size, rate)
+
+    def fetch(self, url, headers=None):
+        """Return (status, text, final url) of a GET request; raises TimeoutError on timeouts"""
+        import requests
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.Timeout as e:
+            raise TimeoutError(f"Timed out fetching {url}") from e
+        return response.status_code, response.text, response.url
+
+    def lookup(self, artist, track_name):
+        """Return the lyrics, or None if no source has them.
+
+        Raises BlockedError for CAPTCHA/rate limit pages, TimeoutError on timeouts and
+        RuntimeError for other HTTP errors.
+        """
+        return self.pipeline.lookup(artist, track_name, self.fetch)
+
+    def close(self):
+        self.pipeline.close()
+        self.session.close()
+
+
+class SeleniumEngine:
+    """Drive Chrome through the Google home page using browsers leased from a DriverPool.
+
+    With direct=True the results page URL is opened instead, so a lookup is one page load without
+    typing, and it ends as soon as the page shows the lyrics or definitely has none.
+    Without a shared pool a private single-browser pool is created and closed with the engine.
+    """
+
+    def __init__(self, lang, base_url=GOOGLE_URL, pool=None, direct=False):
+        self.lang = lang
+        self.base_url = base_url
+        self.lang_split = lang_split_for(lang)
+        self.direct = direct
+        self.owns_pool = pool is None
+        if pool is None:
+            pool = DriverPool(1, fast=direct)
+            pool.start()
+        self.pool = pool
+
+    def lookup(self, artist, track_name):
+        """Return the lyrics, or None if the lyrics block did not appear.
+
+        Raises BlockedError when a CAPTCHA or consent page is shown and TimeoutError when the
+        search box never appears.
+        """
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait as wait
+
+        if self.direct:
+            return self.lookup_direct(artist, track_name)
+        with self.pool.lease() as driver:
+            with METRICS.timed("page_load"):
+                driver.get(self.base_url.rstrip("/") + "/")
+            try:
+                with METRICS.timed("search_box"):
+                    element = wait(driver, 3).until(
+                        EC.visibility_of_element_located((By.NAME, 'q'))
+                    )
+            except TimeoutException as e:
+                self.check_blocked(driver)
+                raise TimeoutError("Search box did not appear") from e
+            with METRICS.timed("send_keys"):
+                element.send_keys(search_query_for(artist, track_name), Keys.ENTER)
+            try:
+                with METRICS.timed("lyrics_wait"):
+                    lyrics_elem = wait(driver, 3).until(
+                        EC.presence_of_element_located((By.XPATH, LYRICS_XPATH))
+                    )
+            except TimeoutException:
+                self.check_blocked(driver)
+                return None
+            with METRICS.timed("extract"):
+                text = lyrics_elem.text
+            if text:
+                # Split the text based on the chosen language
+                return Lyrics(text.split(self.lang_split)[0], "google")
+            return None
+
+    def lookup_direct(self, artist, track_name):
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.support.ui import WebDriverWait as wait
+
+        url = search_url(self.base_url, search_query_for(artist, track_name), self.lang)
+        with self.pool.lease() as driver:
+            with METRICS.timed("page_load"):
+                driver.get(url)
+            try:
+                with METRICS.timed("lyrics_wait"):
+                    state = wait(driver, 3, poll_frequency=0.05).until(
+                        lambda d: d.execute_script(RESULTS_STATE_SCRIPT, LYRICS_XPATH)
+                    )
+            except TimeoutException:
+                self.check_blocked(driver)
+                return None
+            if state == "blocked":
+                raise BlockedError(f"Blocked at {driver.current_url}")
+            if state == "no_panel":
+                return None
+            with METRICS.timed("extract"):
+                text = state.text
+            if text:
+                return Lyrics(text.split(self.lang_split)[0], "google")
+            return None
+
+    @staticmethod
+    def check_blocked(driver):
+        if is_block_page(driver.page_source, driver.current_url):
+            raise BlockedError(f"Blocked at {driver.current_url}")
+
+    def close(self):
+        if self.owns_pool and self.pool:
+            self.pool.close()
+        self.pool = None
+
+
+class FallbackEngine:
+    """Try the HTTP engine first and only start Chrome for rows it cannot resolve.
+
+    The primary engine is shared and is not closed here; the Chrome fallback is created lazily,
+    and a shared DriverPool that was not started launches its browsers on the first fallback.
+    """
+
+    def __init__(self, primary, fallback_factory):
+        self.primary = primary
+        self.fallback_factory = fallback_factory
+        self.fallback = None
+
+    def lookup(self, artist, track_name):
+        try:
+            lyrics = self.primary.lookup(artist, track_name)
+            if lyrics:
+                return lyrics
+        except Exception as e:
+            log_error("HTTP engine error, falling back to Chrome", song=f"{artist} - {track_name}", stage="http",
+                      outcome=classify(None, e), error=str(e))
+        if self.fallback is None:
+            self.fallback = self.fallback_factory()
+        return self.fallback.lookup(artist, track_name)
+
+    def close(self):
+        if self.fallback:
+            self.fallback.close()
+            self.fallback = None
+
+
+def create_engine(name, lang, http_engine=None, driver_pool=None, base_url=GOOGLE_URL):
+    """Build a per-worker engine. HTTP engines and driver pools can be shared between workers.
+
+    Browsers only read Google's results page; other lyrics sources are asked by the HTTP engine.
+    """
+    if name == "chrome":
+        return SeleniumEngine(lang, base_url, driver_pool)
+    if name == "headless":
+        return SeleniumEngine(lang, base_url, driver_pool, direct=True)
+    if http_engine is None:
+        http_engine = HttpEngine(lang, base_url)
+    if name == "http":
+        return http_engine
+    if name == "auto":
+        return FallbackEngine(http_engine, lambda: SeleniumEngine(lang, base_url, driver_pool))
+    raise ValueError(f"Unknown engine: {name}")
@@ -0,0 +1,125 @@
+import os
+
+from output import NOT_FOUND
+from store import DONE, FAILED, JobStore
+
+FORMATS = ("csv", "parquet", "feather")
+EXTENSIONS = {".csv": "csv", ".parquet": "parquet", ".pq": "parquet", ".feather": "feather", ".arrow": "feather"}
+
+# Per-row status in the exported dataset
+FOUND = "found"
+MISSING = "not_found"
+FAILED_STATUS = "failed"
+PENDING_STATUS = "pending"
+
+
+def format_for(path):
+    """Guess the export format from a file name, CSV by default"""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), "csv")
+
+
+class CsvSink:
+    def __init__(self, path):
+        # utf-8-sig like the input datasets, so Excel shows the lyrics correctly
+        self.file = open(path, "w", encoding="utf-8-sig", newline="")
+        self.header = True
+
+    def write(self, frame):
+        frame.to_csv(self.file, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowSink:
+    """Parquet or Feather (Arrow IPC) file, written one chunk at a time with every column as text"""
+
+    def __init__(self, path, fmt):
+        try:
+            import pyarrow
+        except ImportError as e:
+            raise RuntimeError(f"{fmt} export needs pyarrow (pip install pyarrow), or export to .csv") from e
+        self.pa = pyarrow
+        self.path = path
+        self.fmt = fmt
+        self.schema = None
+        self.writer = None
+
+    def write(self, frame):
+        pa = self.pa
+        if self.writer is None:
+            # Fixed up front: a chunk whose source column is all empty would otherwise be typed null
+            self.schema = pa.schema([(str(name), pa.string()) for name in frame.columns])
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+
+                self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+            else:
+                options = pa.ipc.IpcWriteOptions(compression="lz4")
+                self.writer = pa.ipc.new_file(self.path, self.schema, options=options)
+        self.writer.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+
+def row_result(stored, artist, track_name):
+    """Return (lyrics, status, source) of an input row from its job store entry, or None if it has none"""
+    if stored is None:
+        return None, PENDING_STATUS, None
+    stored_artist, stored_track, status, result, source = stored
+    if (stored_artist, stored_track) != (artist, track_name):
+        # The CSV changed since the crawl; the next crawl looks this row up again
+        return None, PENDING_STATUS, None
+    if status == DONE:
+        if result == NOT_FOUND:
+            return None, MISSING, source
+        return result, FOUND, source
+    if status == FAILED:
+        return None, FAILED_STATUS, None
+    return None, PENDING_STATUS, None
+
+
+def export_dataset(input_path, store_path, output_path, fmt=None, chunksize=10000, on_progress=None):
+    """Write the input CSV with lyrics, status and source columns joined from a crawl's job store.
+
+    The CSV is read chunksize rows at a time and each chunk is joined with the job store rows of the
+    same row ids (see ingest.iter_rows), so memory does not depend on the dataset size. Every input
+    column is kept as text, and existing lyrics, status or source columns are replaced. Status is
+    found, not_found, failed or pending; source names where the lyrics came from ("cache" for rows
+    answered by the lyrics cache). on_progress(rows) is called after each chunk. Returns {status: rows}.
+    """
+    import pandas as pd
+
+    if not os.path.exists(store_path):
+        raise FileNotFoundError(f"No crawl results for {input_path} at {store_path}; crawl it first")
+    fmt = fmt or format_for(output_path)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    store = JobStore(store_path)
+    sink = CsvSink(output_path) if fmt == "csv" else ArrowSink(output_path, fmt)
+    counts = {}
+    row_id = 0
+    try:
+        reader = pd.read_csv(input_path, dtype=str, keep_default_na=False, chunksize=chunksize)
+        with reader:
+            for chunk in reader:
+                stored = store.results_between(row_id, row_id + len(chunk))
+                columns = ([], [], [])
+                songs = zip(chunk["artists"].tolist(), chunk["track_name"].tolist())
+                for offset, (artist, track_name) in enumerate(songs):
+                    result = row_result(stored.get(row_id + offset), artist, track_name)
+                    counts[result[1]] = counts.get(result[1], 0) + 1
+                    for column, value in zip(columns, result):
+                        column.append(value)
+                chunk["lyrics"], chunk["status"], chunk["source"] = columns
+                sink.write(chunk)
+                row_id += len(chunk)
+                if on_progress:
+                    on_progress(row_id)
+    finally:
+        sink.close()
+        store.close()
+    return counts
@@ -0,0 +1,49 @@
+import hashlib
+
+from normalize import canonical_key
+
+COLUMNS = ["artists", "track_name"]
+
+
+def iter_rows(path, chunksize=50000):
+    """Stream (row_id, artist, track_name) tuples from a CSV without loading the whole file.
+
+    Only the artists and track_name columns are parsed, chunksize rows at a time, and row_id is the
+    0-based data row number, the same as the index pd.read_csv would assign.
+    """
+    import pandas as pd  # Imported here so worker processes, which never read CSV files, skip it
+
+    row_id = 0
+    reader = pd.read_csv(path, usecols=COLUMNS, dtype=str, keep_default_na=False, chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            for artist, track_name in zip(chunk["artists"].tolist(), chunk["track_name"].tolist()):
+                yield row_id, artist, track_name
+                row_id += 1
+
+
+def parse_shard(value):
+    """Parse an "i/n" shard spec (1 <= i <= n) into (i, n)"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/n, got {value!r}") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard index must be between 1 and {count}, got {index}")
+    return index, count
+
+
+def shard_of(key, count):
+    """Return the 1-based shard a canonical key belongs to, the same on every machine"""
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big") % count + 1
+
+
+def shard_rows(rows, index, count):
+    """Keep the rows of shard index out of count.
+
+    Rows are split by canonical key rather than row number, so duplicates of a song always land
+    in the same shard and are still looked up only once.
+    """
+    for row in rows:
+        if shard_of(canonical_key(row[1], row[2]), count) == index:
+            yield row
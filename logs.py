@@ -0,0 +1,196 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+LOG_PATH = "error_log.jsonl"
+MAX_BYTES = 5 * 1024 * 1024  # The log is rotated once it would grow past this size
+BACKUP_COUNT = 3  # Rotated logs kept as error_log.jsonl.1 (newest) to .3
+REPEAT_WINDOW = 60.0  # Seconds during which further identical errors are only counted
+# Optional structured fields of a record, passed to log_error() as keyword arguments
+FIELDS = ("worker", "rows", "song", "stage", "outcome", "error")
+
+logger = logging.getLogger("lyrics")
+logger.propagate = False
+_lock = threading.Lock()
+_writer = None
+
+_STOP = object()
+
+
+def iso_time(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp % 1 * 1000):03d}"
+
+
+class LogWriter(threading.Thread):
+    """Background thread writing queued log records to a JSON lines file, so logging threads only enqueue.
+
+    Records are written in batches, with the file kept open between them and rotated by size. The first
+    record of an error is written straight away; identical ones (same stage, outcome, message and traceback)
+    during the following repeat_window seconds are only counted, and written as one record with a
+    "repeated" count when the window ends, so a block storm costs one line per error instead of thousands.
+    """
+
+    def __init__(self, records, path=LOG_PATH, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                 repeat_window=REPEAT_WINDOW, batch_size=500, flush_interval=1.0):
+        super().__init__(name="log-writer", daemon=True)
+        self.records = records
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.repeat_window = repeat_window
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.repeats = {}  # (stage, outcome, message with traceback) -> [first entry, repeats, monotonic first seen]
+        self.stream = None  # Opened on the first write, so runs without errors leave no file
+
+    def run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self.records.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                break
+            if record is not None:
+                batch.append(record)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self.flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+        self.flush(batch, final=True)
+        if self.stream:
+            self.stream.close()
+
+    @staticmethod
+    def entry(record):
+        """The JSON object of a record; a multi-line message is split into message and traceback"""
+        message, _, details = record.getMessage().partition("\n")
+        entry = {"time": iso_time(record.created), "level": record.levelname, "message": message}
+        if record.processName != "MainProcess":
+            entry["process"] = record.processName
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if details.strip():
+            entry["traceback"] = details.rstrip()
+        return entry
+
+    def flush(self, batch, final=False):
+        now = time.monotonic()
+        lines = []
+        for record in batch:
+            # Checked before the record is formatted, which repeats never need
+            key = (getattr(record, "stage", None), getattr(record, "outcome", None), str(record.msg))
+            seen = self.repeats.get(key)
+            if seen:
+                seen[1] += 1
+                continue
+            try:
+                entry = self.entry(record)
+            except Exception as e:
+                entry = {"time": iso_time(time.time()), "level": "ERROR", "message": f"Unloggable record: {e}"}
+            self.repeats[key] = [entry, 0, now]
+            lines.append(json.dumps(entry, ensure_ascii=False, default=str))
+        for key, (entry, count, first_seen) in list(self.repeats.items()):
+            if final or now - first_seen >= self.repeat_window:
+                del self.repeats[key]
+                if count:
+                    # Only the parts of the key; worker, song and error differ between the repeats
+                    summary = {name: entry[name] for name in ("level", "message", "stage", "outcome") if name in entry}
+                    summary.update(time=iso_time(time.time()), repeated=count, over_seconds=round(now - first_seen))
+                    lines.append(json.dumps(summary, ensure_ascii=False, default=str))
+        if lines:
+            self.write("".join(line + "\n" for line in lines))
+
+    def write(self, text):
+        try:
+            data = text.encode("utf-8")
+            if self.stream is None:
+                self.stream = open(self.path, "ab")
+            if self.stream.tell() and self.stream.tell() + len(data) > self.max_bytes:
+                self.rotate()
+            self.stream.write(data)
+            self.stream.flush()
+        except Exception as e:
+            # Nowhere left to log to
+            sys.stderr.write(f"LogWriter write error: {e}\n{traceback.format_exc()}")
+
+    def rotate(self):
+        self.stream.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        self.stream = open(self.path, "wb")
+
+    def close(self):
+        """Write everything still queued, including pending repeat counts, and stop the thread"""
+        self.records.put(_STOP)
+        self.join()
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records as they are; the LogWriter in this process formats them off the logging thread"""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(handler=None, path=LOG_PATH):
+    """Send the crawler's log records to handler, or by default through a queue to a LogWriter writing path.
+
+    Called by the first log_error() if nothing else did; worker processes pass a handler that
+    forwards their records to the main process.
+    """
+    global _writer
+    with _lock:
+        if handler is None and _writer is not None:
+            return  # Another thread got here first
+        for old in list(logger.handlers):
+            logger.removeHandler(old)
+        if handler is None:
+            records = queue.SimpleQueue()
+            _writer = LogWriter(records, path)
+            _writer.start()
+            atexit.register(stop_logging)
+            handler = LocalQueueHandler(records)
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+def log_error(message, **fields):
+    """Queue an error record; fields are any of FIELDS, e.g. worker=2, stage="lookup" """
+    if not logger.handlers:
+        setup_logging()
+    # Built directly rather than with logger.error(), which walks the stack to find the caller
+    logger.handle(logger.makeRecord(logger.name, logging.ERROR, "", 0, message, None, None, extra=fields))
+
+
+def forward_record(record):
+    """Log a record made in another process, e.g. received from a worker process"""
+    if not logger.handlers:
+        setup_logging()
+    logger.handle(record)
+
+
+def stop_logging():
+    """Flush and stop the log writer of this process, if it has one"""
+    global _writer
+    with _lock:
+        writer, _writer = _writer, None
+        if writer:
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+    if writer:
+        writer.close()
@@ -0,0 +1,281 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from logs import log_error
+
+# Histogram bucket upper bounds in seconds: 0.1 ms to about 5 minutes in steps of 1.5x
+BOUNDS = tuple(0.0001 * 1.5 ** i for i in range(38))
+
+# Outcome counters listed in the summary
+OUTCOME_COUNTERS = ("found", "no_panel", "blocked", "timeout", "error", "cached")
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; percentiles are interpolated within a bucket. Not locked."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)  # The last bucket holds values above BOUNDS[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect_left(BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                low = BOUNDS[i - 1] if i else 0.0
+                high = BOUNDS[i] if i < len(BOUNDS) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+def memory_mb():
+    """Return the resident memory of this process and of its children (browsers, worker processes) in MB"""
+    import psutil
+
+    try:
+        process = psutil.Process()
+        children = 0
+        for child in process.children(recursive=True):
+            try:
+                children += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return {"process": process.memory_info().rss / (1024 * 1024), "children": children / (1024 * 1024)}
+    except psutil.Error:
+        return {"process": 0.0, "children": 0.0}
+
+
+class Metrics:
+    """Latency histograms per stage and counters per outcome, optionally broken down per worker.
+
+    Stages are things like "page_load" or "http_fetch"; every finished lookup is also recorded as
+    the "lookup" stage and counted under its outcome and "rows" for its worker. Safe to share
+    between threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.histograms = {}  # (stage, worker or None) -> Histogram
+            self.counters = {}  # (name, worker or None) -> int
+            self.gauges = {}  # (name, worker) -> last value
+
+    def restart_clock(self):
+        """Measure elapsed time and rows/s from now on, keeping everything recorded so far"""
+        with self.lock:
+            self.started = time.monotonic()
+
+    def observe(self, stage, seconds, worker=None):
+        with self.lock:
+            keys = [(stage, None)] if worker is None else [(stage, None), (stage, worker)]
+            for key in keys:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.observe(seconds)
+
+    def count(self, name, n=1, worker=None):
+        with self.lock:
+            self.counters[(name, None)] = self.counters.get((name, None), 0) + n
+            if worker is not None:
+                self.counters[(name, worker)] = self.counters.get((name, worker), 0) + n
+
+    def gauge(self, name, value, worker):
+        with self.lock:
+            self.gauges[(name, worker)] = value
+
+    def drain(self):
+        """Return and clear the histograms and counters recorded so far, to merge them in another process"""
+        with self.lock:
+            histograms = {key: (h.buckets, h.count, h.sum, h.max) for key, h in self.histograms.items()}
+            counters = self.counters
+            self.histograms = {}
+            self.counters = {}
+        return histograms, counters
+
+    def merge(self, drained):
+        """Add the output of another process's drain()"""
+        histograms, counters = drained
+        with self.lock:
+            for key, (buckets, count, total, peak) in histograms.items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.buckets = [a + b for a, b in zip(histogram.buckets, buckets)]
+                histogram.count += count
+                histogram.sum += total
+                histogram.max = max(histogram.max, peak)
+            for key, n in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + n
+
+    @contextmanager
+    def timed(self, stage, worker=None):
+        """Record the time spent in the with block as one observation of stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, worker)
+
+    def snapshot(self):
+        """Return the current metrics as a JSON-serializable dict"""
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            stages = {stage: h.summary() for (stage, worker), h in self.histograms.items() if worker is None}
+            counters = {name: n for (name, worker), n in self.counters.items() if worker is None}
+            workers = {}
+            for (name, worker), n in self.counters.items():
+                if worker is not None:
+                    workers.setdefault(str(worker), {})[name] = n
+            for (stage, worker), h in self.histograms.items():
+                if worker is not None and stage == "lookup":
+                    workers.setdefault(str(worker), {})["lookup"] = h.summary()
+            for (name, worker), value in self.gauges.items():
+                workers.setdefault(str(worker), {})[name] = value
+        for stats in workers.values():
+            stats["rows_per_second"] = stats.get("rows", 0) / elapsed if elapsed else 0.0
+        return {
+            "timestamp": time.time(),
+            "elapsed": elapsed,
+            "rows": counters.get("rows", 0),
+            "rows_per_second": counters.get("rows", 0) / elapsed if elapsed else 0.0,
+            "counters": counters,
+            "stages": stages,
+            "workers": workers,
+            "memory_mb": memory_mb(),
+        }
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            counters = sorted(self.counters.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            gauges = sorted(self.gauges.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        lines.append("# TYPE lyrics_stage_seconds histogram")
+        for (stage, worker), h in histograms:
+            labels = f'stage="{stage}"' + (f',worker="{worker}"' if worker is not None else "")
+            cumulative = 0
+            for bound, n in zip(BOUNDS, h.buckets):
+                cumulative += n
+                lines.append(f'lyrics_stage_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'lyrics_stage_seconds_bucket{{{labels},le="+Inf"}} {h.count}')
+            lines.append(f"lyrics_stage_seconds_sum{{{labels}}} {h.sum:.6f}")
+            lines.append(f"lyrics_stage_seconds_count{{{labels}}} {h.count}")
+        lines.append("# TYPE lyrics_events_total counter")
+        for (name, worker), n in counters:
+            labels = f'name="{name}"' + (f',worker="{worker}"' if worker is not None else "")
+            lines.append(f"lyrics_events_total{{{labels}}} {n}")
+        memory = memory_mb()
+        lines.append("# TYPE lyrics_memory_megabytes gauge")
+        for kind, value in memory.items():
+            lines.append(f'lyrics_memory_megabytes{{kind="{kind}"}} {value:.1f}')
+        for i, ((name, worker), value) in enumerate(gauges):
+            if not i or gauges[i - 1][0][0] != name:
+                lines.append(f"# TYPE lyrics_worker_{name} gauge")
+            lines.append(f'lyrics_worker_{name}{{worker="{worker}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary_text(self):
+        """Return a human-readable end-of-run summary"""
+        snapshot = self.snapshot()
+        counters = snapshot["counters"]
+        lines = [
+            f"{snapshot['rows']} rows in {snapshot['elapsed']:.1f}s ({snapshot['rows_per_second']:.1f} rows/s), "
+            f"memory {snapshot['memory_mb']['process']:.0f} MB + {snapshot['memory_mb']['children']:.0f} MB in child processes",
+            "Outcomes: " + ", ".join(f"{name} {counters.get(name, 0)}" for name in OUTCOME_COUNTERS),
+        ]
+        # Lyrics sources count their outcomes as "<source>:<outcome>", see sources.SourcePipeline
+        sources = {}
+        for name, n in counters.items():
+            source, _, outcome = name.rpartition(":")
+            if source:
+                sources.setdefault(source, {})[outcome] = n
+        for source, outcomes in sorted(sources.items()):
+            lookups = sum(outcomes.values())
+            lines.append(f"Source {source}: {lookups} lookups, {outcomes.get('found', 0) / lookups:.0%} hits, "
+                         + ", ".join(f"{outcome} {n}" for outcome, n in sorted(outcomes.items())))
+        lines += [
+            "Stage latency (ms):          count      p50      p95      p99      max",
+        ]
+        for stage, stats in sorted(snapshot["stages"].items()):
+            lines.append(
+                f"  {stage:<24} {stats['count']:>8} {stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} "
+                f"{stats['p99'] * 1000:>8.1f} {stats['max'] * 1000:>8.1f}"
+            )
+        for worker, stats in sorted(snapshot["workers"].items(), key=lambda item: int(item[0])):
+            lookup = stats.get("lookup", Histogram().summary())
+            lines.append(
+                f"  Worker {int(worker) + 1}: {stats.get('rows', 0)} rows ({stats['rows_per_second']:.1f}/s), "
+                f"lookup p50 {lookup['p50'] * 1000:.0f} ms, p95 {lookup['p95'] * 1000:.0f} ms, "
+                f"p99 {lookup['p99'] * 1000:.0f} ms"
+                + (f", memory {stats['memory_mb']:.0f} MB" if "memory_mb" in stats else "")
+            )
+        return "\n".join(lines)
+
+
+# Shared by the engines, workers and writer of the current run
+METRICS = Metrics()
+
+
+def write_atomic(path, text):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+class MetricsExporter(threading.Thread):
+    """Write <prefix>.json and <prefix>.prom snapshots every `interval` seconds and once more on close()"""
+
+    def __init__(self, metrics, prefix, interval=10.0):
+        super().__init__(name="metrics-exporter", daemon=True)
+        self.metrics = metrics
+        self.prefix = prefix
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            write_atomic(self.prefix + ".json", json.dumps(self.metrics.snapshot(), indent=2))
+            write_atomic(self.prefix + ".prom", self.metrics.prometheus())
+        except Exception as e:
+            log_error(f"MetricsExporter export error: {e}")
+
+    def close(self):
+        self.stopped.set()
+        self.join()
+        self.export()
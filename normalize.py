@@ -0,0 +1,49 @@
+import re
+
+ARTIST_SEPARATOR = ";"
+
+# Words that mark a recording variant whose lyrics are the same as the original song
+VERSION_WORDS = (
+    r"acoustic|live|remaster(?:ed)?|mono|stereo|demo|deluxe|bonus track|explicit|clean|re-?recorded|unplugged|"
+    r"feat\.?|ft\.?|ao vivo|en vivo|ac[uú]stic[oa]"
+)
+# Everyday words that only mark a variant in these phrases: "Radio Edit", "Album Version", "Versión Acústica",
+# "BBC Session", 'From "Frozen"', "From The Motion Picture ..."
+VERSION_PHRASES = (
+    r"(?:radio|single|album|extended|original|short)\s+edit\b|\w+\s+version\b|versi[oó]n\s+\w|vers[aã]o\s+\w|"
+    r"\w+\s+sessions?\b|"
+    r"from\s+(?:the\s+)?(?:[\"“'«]|[^\"“]*?\b(?:film|movie|motion picture|soundtrack|musical|series)\b)"
+)
+VERSION = rf"\b(?:(?:{VERSION_WORDS})\b|{VERSION_PHRASES})"
+# "Ghost - Acoustic", "Song - 2011 Remaster", "Song - Live at Wembley"
+DASH_SUFFIX = re.compile(rf"\s+-\s+(?:[^-]*{VERSION}.*)$", re.IGNORECASE)
+# "Song (Remastered 2009)", "Song [Live]", "Song (feat. Someone)", "Song (with Someone)"
+BRACKET_SUFFIX = re.compile(rf"\s*[(\[](?:\s*with\s|[^()\[\]]*{VERSION})[^()\[\]]*[)\]]", re.IGNORECASE)
+
+
+def split_artists(artists):
+    """Split a `;` separated artist list, dropping empty names"""
+    return [a.strip() for a in str(artists).split(ARTIST_SEPARATOR) if a.strip()]
+
+
+def canonical_track(track_name):
+    """Strip version suffixes such as " - Acoustic" or "(Remastered 2011)" from a track name"""
+    name = str(track_name).strip()
+    previous = None
+    while name != previous:
+        previous = name
+        name = BRACKET_SUFFIX.sub("", name).strip()
+        name = DASH_SUFFIX.sub("", name).strip()
+    return name or str(track_name).strip()
+
+
+def search_terms(artists, track_name):
+    """Return the (artist, track_name) to search for: the primary artist and the canonical track"""
+    names = split_artists(artists)
+    return (names[0] if names else str(artists).strip()), canonical_track(track_name)
+
+
+def canonical_key(artists, track_name):
+    """Key shared by every row that resolves to the same lyrics"""
+    artist, track = search_terms(artists, track_name)
+    return " ".join(artist.split()).casefold() + "\x1f" + " ".join(track.split()).casefold()
@@ -0,0 +1,401 @@
+import argparse
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import zlib
+
+from utils import sanitize_filename
+
+TREE = "tree"
+ARCHIVE = "archive"
+DEDUP = "dedup"
+OUTPUTS = (TREE, ARCHIVE, DEDUP)
+
+TREE_PATH = "lyrics"
+ARCHIVE_PATH = "lyrics.archive"
+DEDUP_PATH = "lyrics.dedup"
+
+# Written in place of the lyrics of songs none were found for, except by LyricsDedup
+NOT_FOUND = "Not Found"
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    entry_key TEXT PRIMARY KEY,
+    artist TEXT NOT NULL,
+    track_name TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    compressed INTEGER NOT NULL
+);
+"""
+
+DEDUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash BLOB PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS songs (
+    entry_key TEXT PRIMARY KEY,
+    artist TEXT NOT NULL,
+    track_name TEXT NOT NULL,
+    hash BLOB
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS songs_hash ON songs (hash);
+"""
+
+
+def entry_key(artist, track_name):
+    return f"{artist}\x1f{track_name}"
+
+
+def normalize_lyrics(lyrics):
+    """Return lyrics with unified line endings and no trailing spaces, the form LyricsDedup hashes and keeps"""
+    return "\n".join(line.rstrip() for line in lyrics.replace("\r\n", "\n").split("\n")).strip()
+
+
+def lyrics_hash(text):
+    """Return the SHA-256 digest (32 bytes) identifying a normalized lyrics text"""
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class LyricsTree:
+    """Original output layout: lyrics/<artist>/<track>.txt, one file per song"""
+
+    def __init__(self, path=TREE_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write_many(self, items):
+        """Write (artist, track_name, lyrics) items, skipping songs that already have a file.
+
+        lyrics is None for songs without lyrics; they get a NOT_FOUND file like before.
+        """
+        for artist, track_name, lyrics in items:
+            artist_dir = os.path.join(self.path, sanitize_filename(artist))
+            os.makedirs(artist_dir, exist_ok=True)
+            lyrics_file = os.path.join(artist_dir, sanitize_filename(track_name) + ".txt")
+            if not os.path.exists(lyrics_file):
+                with open(lyrics_file, "w", encoding="utf-8") as f:
+                    f.write(lyrics or NOT_FOUND)
+
+    def __iter__(self):
+        """Yield (artist, track_name, lyrics) for every file; names are the sanitized folder and file names"""
+        for artist in sorted(os.listdir(self.path)):
+            artist_dir = os.path.join(self.path, artist)
+            if not os.path.isdir(artist_dir):
+                continue
+            for name in sorted(os.listdir(artist_dir)):
+                if name.endswith(".txt"):
+                    with open(os.path.join(artist_dir, name), encoding="utf-8") as f:
+                        yield artist, name[:-len(".txt")], f.read()
+
+    def close(self):
+        pass
+
+
+class LyricsArchive:
+    """Packed output: lyrics appended to a few large segment files plus an SQLite index.
+
+    Writing a song costs one append and one index row instead of a directory and a file, and
+    readers fetch a song with one index lookup and a slice of a memory-mapped segment.
+    Safe to share between threads.
+    """
+
+    INDEX_NAME = "index.sqlite"
+    SCHEMA = INDEX_SCHEMA
+    SONG_TABLE = "entries"  # One row per song, keyed by entry_key
+    SEGMENT_TABLE = "entries"  # Table whose rows point into the segments
+
+    def __init__(self, path=ARCHIVE_PATH, segment_size=256 * 1024 * 1024, compress=True):
+        self.path = path
+        self.segment_size = segment_size
+        self.compress = compress
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, self.INDEX_NAME), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.segment = self.conn.execute(f"SELECT COALESCE(MAX(segment), 0) FROM {self.SEGMENT_TABLE}").fetchone()[0]
+        self.maps = {}  # segment -> read-only mmap
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, f"segment-{segment:06d}.dat")
+
+    def existing(self, table, column, keys):
+        """Return the subset of keys already present in table.column"""
+        found = set()
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(key for (key,) in self.conn.execute(
+                f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders})", chunk
+            ))
+        return found
+
+    def new_records(self, items):
+        """Return entry key -> (artist, track_name, lyrics) for the items not stored yet"""
+        records = {}
+        for artist, track_name, lyrics in items:
+            records.setdefault(entry_key(artist, track_name), (artist, track_name, lyrics))
+        for key in self.existing(self.SONG_TABLE, "entry_key", records):
+            del records[key]
+        return records
+
+    def append(self, texts):
+        """Append texts to the segments and return (segment, offset, length) for each"""
+        locations = []
+        f = open(self.segment_path(self.segment), "ab")
+        try:
+            for text in texts:
+                data = text.encode("utf-8")
+                if self.compress:
+                    data = zlib.compress(data)
+                if f.tell() and f.tell() + len(data) > self.segment_size:
+                    f.close()
+                    self.segment += 1
+                    f = open(self.segment_path(self.segment), "ab")
+                locations.append((self.segment, f.tell(), len(data)))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        return locations
+
+    def write_many(self, items):
+        """Append (artist, track_name, lyrics) items, skipping songs that are already archived"""
+        with self.lock:
+            records = self.new_records(items)
+            if not records:
+                return
+            locations = self.append(lyrics or NOT_FOUND for artist, track_name, lyrics in records.values())
+            index_rows = [
+                (key, artist, track_name, *location, int(self.compress))
+                for (key, (artist, track_name, lyrics)), location in zip(records.items(), locations)
+            ]
+            with self.conn:
+                self.conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", index_rows)
+
+    def _read(self, segment, offset, length, compressed):
+        mapped = self.maps.get(segment)
+        if mapped is None or offset + length > len(mapped):
+            # Segments only grow, so remap when the entry lies past the mapped size
+            if mapped is not None:
+                mapped.close()
+            with open(self.segment_path(segment), "rb") as f:
+                mapped = self.maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = mapped[offset:offset + length]
+        return (zlib.decompress(data) if compressed else data).decode("utf-8")
+
+    def get(self, artist, track_name):
+        """Return the archived lyrics of a song, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT segment, offset, length, compressed FROM entries WHERE entry_key = ?",
+                (entry_key(artist, track_name),),
+            ).fetchone()
+            return self._read(*row) if row else None
+
+    def __iter__(self):
+        """Yield (artist, track_name, lyrics) for every archived song"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT artist, track_name, segment, offset, length, compressed FROM entries "
+                "ORDER BY segment, offset"
+            ).fetchall()
+        for artist, track_name, *location in rows:
+            with self.lock:
+                lyrics = self._read(*location)
+            yield artist, track_name, lyrics
+
+    def export_tree(self, path=TREE_PATH):
+        """Write the archive out as the lyrics/<artist>/<track>.txt directory tree"""
+        LyricsTree(path).write_many(self)
+
+    def close(self):
+        with self.lock:
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps = {}
+            self.conn.close()
+
+
+class LyricsDedup(LyricsArchive):
+    """Content-addressed archive: every distinct lyrics text is stored once, compressed.
+
+    Lyrics are normalized (normalize_lyrics) and hashed with SHA-256; a new text is appended to the
+    segments as a blob, and each song only records the hash of its text. Songs without lyrics are a
+    row with no hash, not a NOT_FOUND text. The same song on several albums, versions or artist
+    spellings costs one index row, and songs sharing lyrics are one index lookup away.
+    Safe to share between threads.
+    """
+
+    INDEX_NAME = "songs.sqlite"
+    SCHEMA = DEDUP_SCHEMA
+    SONG_TABLE = "songs"
+    SEGMENT_TABLE = "blobs"
+
+    def __init__(self, path=DEDUP_PATH, segment_size=256 * 1024 * 1024):
+        super().__init__(path, segment_size, compress=True)
+
+    def write_many(self, items):
+        """Store (artist, track_name, lyrics) items, skipping songs already stored; lyrics is None for misses"""
+        with self.lock:
+            records = self.new_records(items)
+            if not records:
+                return
+            song_rows = []
+            texts = {}  # hash -> text, for texts new to this batch
+            for key, (artist, track_name, lyrics) in records.items():
+                digest = None
+                if lyrics and lyrics != NOT_FOUND:
+                    text = normalize_lyrics(lyrics)
+                    digest = lyrics_hash(text)
+                    texts.setdefault(digest, text)
+                song_rows.append((key, artist, track_name, digest))
+            for digest in self.existing("blobs", "hash", texts):
+                del texts[digest]
+            locations = self.append(texts.values())
+            blob_rows = [
+                (digest, *location, len(text.encode("utf-8")))
+                for (digest, text), location in zip(texts.items(), locations)
+            ]
+            with self.conn:
+                self.conn.executemany("INSERT INTO blobs VALUES (?, ?, ?, ?, ?)", blob_rows)
+                self.conn.executemany("INSERT INTO songs VALUES (?, ?, ?, ?)", song_rows)
+
+    def read_blob(self, digest):
+        row = self.conn.execute("SELECT segment, offset, length FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        return self._read(*row, True) if row else None
+
+    def get(self, artist, track_name):
+        """Return the lyrics of a song, or None if it has none or is not stored"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash FROM songs WHERE entry_key = ?", (entry_key(artist, track_name),)
+            ).fetchone()
+            return self.read_blob(row[0]) if row and row[0] else None
+
+    def __iter__(self):
+        """Yield (artist, track_name, lyrics) for every song, with lyrics None for misses"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT artist, track_name, hash FROM songs LEFT JOIN blobs USING (hash) "
+                "ORDER BY segment, offset, artist, track_name"
+            ).fetchall()
+        for artist, track_name, digest in rows:
+            with self.lock:
+                lyrics = self.read_blob(digest) if digest else None
+            yield artist, track_name, lyrics
+
+    def shared_lyrics(self, min_songs=2):
+        """Yield (hex hash, [(artist, track_name), ...]) for every text shared by at least min_songs songs"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT hash, artist, track_name FROM songs WHERE hash IN "
+                "(SELECT hash FROM songs WHERE hash IS NOT NULL GROUP BY hash HAVING COUNT(*) >= ?) "
+                "ORDER BY hash, artist, track_name",
+                (min_songs,),
+            ).fetchall()
+        group, songs = None, []
+        for digest, artist, track_name in rows:
+            if digest != group:
+                if songs:
+                    yield group.hex(), songs
+                group, songs = digest, []
+            songs.append((artist, track_name))
+        if songs:
+            yield group.hex(), songs
+
+    def songs_with_lyrics_of(self, artist, track_name):
+        """Return the other songs stored with exactly the same lyrics as the given one"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT artist, track_name FROM songs WHERE hash = "
+                "(SELECT hash FROM songs WHERE entry_key = ?) AND entry_key != ? ORDER BY artist, track_name",
+                (entry_key(artist, track_name), entry_key(artist, track_name)),
+            ).fetchall()
+
+    def stats(self):
+        """Return songs, songs without lyrics, distinct texts, their total size and the bytes stored"""
+        with self.lock:
+            songs, misses = self.conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(hash) FROM songs"
+            ).fetchone()
+            blobs, size, stored = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM blobs"
+            ).fetchone()
+            referenced = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM songs JOIN blobs USING (hash)"
+            ).fetchone()[0]
+        return {"songs": songs, "not_found": misses, "texts": blobs, "text_bytes": size,
+                "stored_bytes": stored, "undeduplicated_bytes": referenced}
+
+
+def open_output(kind, path=None):
+    """Open the output backend named kind, one of OUTPUTS"""
+    if kind == TREE:
+        return LyricsTree(path or TREE_PATH)
+    if kind == ARCHIVE:
+        return LyricsArchive(path or ARCHIVE_PATH)
+    if kind == DEDUP:
+        return LyricsDedup(path or DEDUP_PATH)
+    raise ValueError(f"Unknown output: {kind}")
+
+
+def output_kind(path):
+    """Return the kind of the output found at path, or None if there is none"""
+    if os.path.exists(os.path.join(path, LyricsDedup.INDEX_NAME)):
+        return DEDUP
+    if os.path.exists(os.path.join(path, "index.sqlite")):
+        return ARCHIVE
+    if os.path.isdir(path):
+        return TREE
+    return None
+
+
+def merge_outputs(path, sources, kind=None):
+    """Merge the outputs of several runs (e.g. shards crawled on different machines) into path.
+
+    The destination keeps its own kind if it exists, otherwise kind, otherwise that of the first
+    source. Songs the destination already has are kept.
+    """
+    kind = output_kind(path) or kind or output_kind(sources[0]) or TREE
+    target = open_output(kind, path)
+    try:
+        for source_path in sources:
+            source = open_output(output_kind(source_path) or TREE, source_path)
+            try:
+                batch = []
+                for item in source:
+                    batch.append(item)
+                    if len(batch) >= 1000:
+                        target.write_many(batch)
+                        batch = []
+                target.write_many(batch)
+            finally:
+                source.close()
+    finally:
+        target.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export a packed or deduplicated lyrics archive as a lyrics/<artist>/<track>.txt tree"
+    )
+    parser.add_argument("archive", nargs="?", default=ARCHIVE_PATH)
+    parser.add_argument("output", nargs="?", default=TREE_PATH)
+    args = parser.parse_args()
+    archive = LyricsDedup(args.archive) if output_kind(args.archive) == DEDUP else LyricsArchive(args.archive)
+    try:
+        archive.export_tree(args.output)
+    finally:
+        archive.close()
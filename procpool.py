@@ -0,0 +1,328 @@
+import itertools
+import logging.handlers
+import multiprocessing
+import queue
+import signal
+import threading
+import traceback
+
+from engines import BROWSER_ENGINES, DriverPool, HttpEngine
+from logs import forward_record, log_error, setup_logging
+from metrics import METRICS, memory_mb
+from ratecontrol import RateController, classify
+from worker import AsyncLookupWorker, LookupWorker
+
+METRICS_INTERVAL = 2.0  # Seconds between metrics reports of a worker process
+
+
+class RemoteTasks:
+    """Worker process side of its task queue, with the part of scheduler.WorkQueue a LookupWorker uses.
+
+    Retries, parking and completion are decided by the main process, so there is nothing to do here
+    but hand out tasks until the None sentinel arrives or the stop event is set.
+    """
+
+    total = 0
+
+    def __init__(self, tasks, stop):
+        self.tasks = tasks
+        self.stop = stop
+        self.exhausted = False
+
+    def lease(self, n=1, block=True):
+        while not (self.exhausted or self.stop.is_set()):
+            try:
+                task = self.tasks.get(timeout=0.5) if block else self.tasks.get_nowait()
+            except queue.Empty:
+                if not block:
+                    return []
+                continue
+            if task is None:
+                self.exhausted = True
+                return []
+            return [task]
+        return []
+
+    def release(self, tasks):
+        pass  # The main process takes back whatever this process did not report
+
+    def is_done(self):
+        return self.exhausted or self.stop.is_set()
+
+    def next_ready_in(self):
+        return None
+
+
+class ResultsLogHandler(logging.handlers.QueueHandler):
+    """Send a worker process's log records to the main process along with its results"""
+
+    def __init__(self, results, worker_id):
+        super().__init__(results)
+        self.worker_id = worker_id
+
+    def enqueue(self, record):
+        self.queue.put(("log", self.worker_id, record))
+
+
+class ChildMixin:
+    """Send lookup results to the main process instead of recording them here"""
+
+    def record(self, task, lyrics, error, latency):
+        pass
+
+    def handle_success(self, task, lyrics, latency):
+        self.results.put(("result", self.worker_id, task, lyrics, None, "", latency))
+
+    def handle_failure(self, task, error, latency):
+        self.results.put(("result", self.worker_id, task, None, classify(None, error), str(error), latency))
+
+
+class ChildWorker(ChildMixin, LookupWorker):
+    def __init__(self, worker_id, tasks, results, settings, http_engine, driver_pool, rate):
+        super().__init__(worker_id, tasks, settings["lang"], None, settings["engine_name"], http_engine,
+                         driver_pool, rate=rate, base_url=settings["base_url"])
+        self.results = results
+
+
+class ChildAsyncWorker(ChildMixin, AsyncLookupWorker):
+    def __init__(self, worker_id, tasks, results, settings, rate):
+        super().__init__(worker_id, tasks, settings["lang"], None, settings["concurrency"], rate=rate,
+                         base_url=settings["base_url"], sources=settings["sources"],
+                         parallel_sources=settings["parallel_sources"])
+        self.results = results
+
+    def run(self):
+        try:
+            from async_crawl import run_crawl
+
+            pipeline = self.create_pipeline()
+            try:
+                while not self.work_queue.is_done():
+                    # Only block while nothing is in flight, then crawl until the queue runs dry
+                    first = self.work_queue.lease(1)
+                    if not first:
+                        break
+                    run_crawl(itertools.chain(first, self.iter_tasks()), self.lang, self.concurrency,
+                              self.handle_result, base_url=self.base_url, rate=self.rate, pipeline=pipeline)
+            finally:
+                pipeline.close()
+        except Exception as e:
+            log_error(f"Worker process run error: {e}\n{traceback.format_exc()}", worker=self.worker_id, stage="run")
+
+
+def process_main(worker_id, settings, tasks, results, stop, shared_pause):
+    """Entry point of a worker process: own engines, `threads` lookup threads, results sent to results"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The main process decides when to stop
+    setup_logging(ResultsLogHandler(results, worker_id))  # Only the main process writes the log file
+    METRICS.reset()
+    http_engine = driver_pool = None
+    reporting = threading.Event()
+
+    def report_metrics():
+        memory = memory_mb()
+        results.put(("metrics", worker_id, METRICS.drain(), memory["process"] + memory["children"]))
+
+    def report_loop():
+        while not reporting.wait(METRICS_INTERVAL):
+            report_metrics()
+
+    try:
+        threading.Thread(target=report_loop, daemon=True).start()
+        remote = RemoteTasks(tasks, stop)
+        rate = RateController(settings["rate"], concurrency=settings["concurrency"], shared_pause=shared_pause,
+                              stop_event=stop)
+        if settings["engine_name"] == "async":
+            ChildAsyncWorker(worker_id, remote, results, settings, rate).run()
+        else:
+            if settings["engine_name"] in ("http", "auto"):
+                http_engine = HttpEngine(settings["lang"], settings["base_url"], pool_size=settings["threads"],
+                                         sources=settings["sources"], parallel_sources=settings["parallel_sources"],
+                                         rate=rate)
+            if settings["engine_name"] in BROWSER_ENGINES:
+                driver_pool = DriverPool(settings["threads"], fast=settings["engine_name"] == "headless")
+                if settings["engine_name"] != "auto":
+                    driver_pool.start()
+            threads = [
+                threading.Thread(target=ChildWorker(worker_id, remote, results, settings, http_engine,
+                                                    driver_pool, rate).run)
+                for _ in range(settings["threads"])
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    except Exception as e:
+        log_error(f"Worker process error: {e}\n{traceback.format_exc()}", worker=worker_id, stage="run")
+    finally:
+        reporting.set()
+        try:
+            if http_engine:
+                http_engine.close()
+            if driver_pool:
+                driver_pool.close()
+        except Exception as e:
+            log_error(f"Worker process cleanup error: {e}", worker=worker_id, stage="cleanup")
+        report_metrics()
+        results.put(("exit", worker_id))
+
+
+class ProcessWorker(LookupWorker):
+    """Main process handle of one worker process; run() lasts as long as the process.
+
+    Results of the process are recorded through this object by the pool's aggregator thread,
+    so progress, logging and retries work exactly as for a thread worker.
+    """
+
+    def __init__(self, worker_id, pool, on_progress=None, on_log=None):
+        job = pool.job
+        super().__init__(worker_id, job.work_queue, job.lang, job.writer, job.engine_name, cache=job.cache,
+                         rate=job.rate, on_progress=on_progress, on_log=on_log, base_url=job.base_url)
+        self.pool = pool
+        self.drained = threading.Event()  # Set once every result of the process has been recorded
+        self.process = pool.context.Process(
+            target=process_main, name=f"lyrics-worker-{worker_id}",
+            args=(worker_id, pool.settings, pool.task_queues[worker_id], pool.results, pool.stop_event,
+                  pool.shared_pause),
+            daemon=True,
+        )
+
+    def run(self):
+        try:
+            self.process.start()
+            self.process.join()
+            if self.process.exitcode:
+                self.log(f"Worker process exited with code {self.process.exitcode}")
+                self.pool.results.put(("crashed", self.worker_id))
+            self.drained.wait()
+            if self.pool.stop_event.is_set():
+                self.log("Exit request received, terminating scraping early.")
+        except Exception as e:
+            self.log(f"Run error: {e}")
+            log_error(f"Worker {self.worker_id} run error: {e}\n{traceback.format_exc()}")
+            self.drained.set()
+
+    def stop(self):
+        self.pool.stop_event.set()
+
+
+class ProcessPool:
+    """Run a CrawlJob's lookups in `processes` worker processes, each with its own engines.
+
+    A feeder thread leases tasks from the job's WorkQueue (answering cache hits itself) and hands
+    each to the least busy process; an aggregator thread records every result streamed back over
+    one queue with the job's writer, store and progress counters. Only the main process touches
+    the job store, cache and output.
+    """
+
+    def __init__(self, job, processes, on_progress=None, on_log=None):
+        self.job = job
+        self.context = multiprocessing.get_context("spawn")  # Forking a process with Qt and threads is unsafe
+        per_process = -(-job.max_workers // processes)
+        self.settings = {
+            "engine_name": job.engine_name,
+            "lang": job.lang,
+            "base_url": job.base_url,
+            "sources": job.sources,
+            "parallel_sources": job.parallel_sources,
+            "threads": per_process,
+            "concurrency": per_process,
+            "rate": job.max_rate / processes,
+        }
+        self.prefetch = max(2, per_process * 2)  # Tasks queued ahead per process
+        self.task_queues = [self.context.Queue() for _ in range(processes)]
+        self.results = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.shared_pause = self.context.Value("d", 0.0)
+        if job.rate:
+            job.rate.shared_pause = self.shared_pause
+        self.assigned = [{} for _ in range(processes)]  # Per process: task key -> task not reported yet
+        self.alive = [True] * processes
+        self.cond = threading.Condition()
+        self.workers = [ProcessWorker(i, self, on_progress, on_log) for i in range(processes)]
+
+    def start(self):
+        threading.Thread(target=self.feed, name="process-pool-feeder", daemon=True).start()
+        threading.Thread(target=self.aggregate, name="process-pool-aggregator", daemon=True).start()
+
+    def feed(self):
+        work_queue = self.job.work_queue
+        try:
+            while not self.stop_event.is_set():
+                tasks = work_queue.lease(1)
+                if not tasks:
+                    break
+                task = tasks[0]
+                worker_id = self.assign(task)
+                if worker_id is None:
+                    work_queue.release(tasks)
+                    break
+                hit, lyrics = self.workers[worker_id].cache_lookup(task)
+                if hit:
+                    self.results.put(("cached", worker_id, task, lyrics))
+                    continue
+                self.task_queues[worker_id].put(task)
+        except Exception as e:
+            log_error(f"ProcessPool feed error: {e}\n{traceback.format_exc()}")
+        finally:
+            for task_queue in self.task_queues:
+                task_queue.put(None)
+
+    def assign(self, task):
+        """Pick the live process with the fewest outstanding tasks, waiting while all are full"""
+        with self.cond:
+            while not self.stop_event.is_set():
+                candidates = [i for i, alive in enumerate(self.alive) if alive]
+                if not candidates:
+                    return None
+                worker_id = min(candidates, key=lambda i: len(self.assigned[i]))
+                if len(self.assigned[worker_id]) < self.prefetch:
+                    self.assigned[worker_id][task[0]] = task
+                    return worker_id
+                self.cond.wait(0.5)
+            return None
+
+    def unassign(self, worker_id, task):
+        with self.cond:
+            self.assigned[worker_id].pop(task[0], None)
+            self.cond.notify_all()
+
+    def aggregate(self):
+        exited = set()
+        while len(exited) < len(self.workers):
+            try:
+                message = self.results.get(timeout=1)
+            except queue.Empty:
+                continue
+            kind, worker_id = message[0], message[1]
+            worker = self.workers[worker_id]
+            try:
+                if kind == "result":
+                    _, _, task, lyrics, outcome, error, latency = message
+                    self.unassign(worker_id, task)
+                    worker.handle_reported(task, lyrics, outcome, error, latency)
+                elif kind == "cached":
+                    _, _, task, lyrics = message
+                    self.unassign(worker_id, task)
+                    worker.finish_cached(task, lyrics)
+                elif kind == "log":
+                    forward_record(message[2])
+                elif kind == "metrics":
+                    _, _, drained, memory = message
+                    METRICS.merge(drained)
+                    METRICS.gauge("memory_mb", round(memory, 1), worker_id)
+                elif kind in ("exit", "crashed") and worker_id not in exited:
+                    exited.add(worker_id)
+                    self.retire(worker_id)
+                    worker.drained.set()
+            except Exception as e:
+                log_error(f"ProcessPool aggregate error: {e}\n{traceback.format_exc()}")
+
+    def retire(self, worker_id):
+        """Give the tasks a finished or crashed process never reported back to the work queue"""
+        with self.cond:
+            self.alive[worker_id] = False
+            leftovers = list(self.assigned[worker_id].values())
+            self.assigned[worker_id].clear()
+            self.cond.notify_all()
+        if leftovers:
+            self.job.work_queue.release(leftovers)
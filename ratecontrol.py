@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+
+# Lookup outcomes
+FOUND = "found"
+NO_PANEL = "no_panel"
+BLOCKED = "blocked"
+TIMEOUT = "timeout"
+ERROR = "error"
+OUTCOMES = (FOUND, NO_PANEL, BLOCKED, TIMEOUT, ERROR)
+
+# Markers of Google's CAPTCHA ("unusual traffic") and cookie consent interstitials
+BLOCK_MARKERS = (
+    'action="/sorry/',
+    "/sorry/index",
+    'id="captcha-form"',
+    "g-recaptcha",
+    "unusual traffic from your computer network",
+    "consent.google.com",
+)
+
+
+class BlockedError(Exception):
+    """Raised by engines when the search engine served a CAPTCHA, consent or rate limit page"""
+
+
+def is_block_page(html, url=""):
+    return "/sorry/" in url or "consent.google.com" in url or any(marker in html for marker in BLOCK_MARKERS)
+
+
+def classify(lyrics, error=None):
+    """Return the outcome of one lookup from its lyrics (None if absent) or the exception it raised"""
+    if error is None:
+        return FOUND if lyrics else NO_PANEL
+    if isinstance(error, BlockedError):
+        return BLOCKED
+    if isinstance(error, TimeoutError):
+        return TIMEOUT
+    return ERROR
+
+
+def error_for(outcome, message):
+    """Rebuild the exception of a lookup done in another process or on another machine from its outcome"""
+    if outcome == BLOCKED:
+        return BlockedError(message)
+    if outcome == TIMEOUT:
+        return TimeoutError(message)
+    return RuntimeError(message)
+
+
+class TokenBucket:
+    """Global request rate limit: `rate` tokens per second with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Take a token; returns 0 on success or the seconds until one is available. Not locked."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateController:
+    """Shared gate in front of every lookup, tuned for the highest sustained rate of useful results.
+
+    Requests go through a token bucket and an adaptive concurrency limit. After `limit` consecutive
+    clean lookups the concurrency grows by one and the rate by a twentieth of max_rate; both are
+    halved as soon as a block is seen (AIMD). Blocks also pause everybody for a cooldown that
+    doubles while blocks keep coming. Safe to use from threads and from an asyncio event loop.
+
+    Controllers in different processes can share their pauses through shared_pause, a
+    multiprocessing.Value("d") holding the time.time() at which the current pause ends.
+    stop() wakes every waiting acquire; worker processes pass their pool's stop event as stop_event.
+    """
+
+    def __init__(self, rate=5.0, concurrency=5, min_concurrency=1, max_concurrency=None,
+                 min_rate=0.2, max_rate=None, cooldown=30.0, max_cooldown=600.0, shared_pause=None,
+                 stop_event=None):
+        self.bucket = TokenBucket(rate)
+        self.limit = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency or concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.paused_until = 0.0
+        self.shared_pause = shared_pause
+        self.stopping = stop_event or threading.Event()
+        self.in_flight = 0
+        self.streak = 0  # Clean lookups since the last adjustment
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Claim a request slot. Returns 0 when granted, otherwise the seconds to wait before retrying."""
+        with self.lock:
+            now = time.monotonic()
+            pause = max(self.paused_until - now, self._shared_pause_remaining())
+            if pause > 0:
+                return pause
+            if self.in_flight >= int(self.limit):
+                return 0.05
+            wait = self.bucket.take(now)
+            if wait:
+                return wait
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        """Wait for a request slot. Returns False without one if stop() is called meanwhile."""
+        while not self.stopping.is_set():
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            # In slices, so a stop is noticed within half a second even during a long cooldown
+            self.stopping.wait(min(wait, 0.5))
+        return False
+
+    async def acquire_async(self):
+        while not self.stopping.is_set():
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            await asyncio.sleep(min(wait, 0.5))
+        return False
+
+    def charge(self):
+        """Take a token for one more request of a lookup that holds a slot already, e.g. to its next source"""
+        while not self.stopping.is_set():
+            with self.lock:
+                wait = self.bucket.take(time.monotonic())
+            if not wait:
+                return
+            self.stopping.wait(min(wait, 0.5))
+
+    async def charge_async(self):
+        while not self.stopping.is_set():
+            with self.lock:
+                wait = self.bucket.take(time.monotonic())
+            if not wait:
+                return
+            await asyncio.sleep(min(wait, 0.5))
+
+    def stop(self):
+        """Make every waiting and future acquire give up"""
+        self.stopping.set()
+
+    def release(self, outcome):
+        """Return a slot and adapt the limits to the outcome of the lookup"""
+        with self.lock:
+            self.in_flight -= 1
+            self.counts[outcome] += 1
+            if outcome == BLOCKED:
+                self.streak = 0
+                now = time.monotonic()
+                # Requests already in flight when the block started do not back off again
+                if now >= self.paused_until:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+                    self.paused_until = now + self.cooldown
+                    if self.shared_pause is not None:
+                        with self.shared_pause.get_lock():
+                            self.shared_pause.value = max(self.shared_pause.value, time.time() + self.cooldown)
+                    self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            elif outcome == TIMEOUT:
+                self.limit = max(self.min_concurrency, self.limit - 1)
+                self.streak = 0
+            elif outcome in (FOUND, NO_PANEL):
+                self.streak += 1
+                if self.streak >= self.limit:
+                    self.streak = 0
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+                    self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 20)
+                    self.cooldown = self.base_cooldown
+
+    def count(self, outcome):
+        """Count an outcome observed elsewhere, e.g. in a worker process, without adapting the limits"""
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def _shared_pause_remaining(self):
+        return self.shared_pause.value - time.time() if self.shared_pause is not None else 0.0
+
+    def pause_remaining(self):
+        with self.lock:
+            return max(0.0, self.paused_until - time.monotonic(), self._shared_pause_remaining())
+
+    def snapshot(self):
+        """Return the current limits and outcome counts"""
+        with self.lock:
+            return {
+                "concurrency": int(self.limit),
+                "rate": round(self.bucket.rate, 2),
+                "paused_for": round(max(0.0, self.paused_until - time.monotonic(), self._shared_pause_remaining()), 1),
+                **self.counts,
+            }
@@ -0,0 +1,135 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from normalize import canonical_key, search_terms
+
+
+def make_task(rows):
+    """Build the task for (row_id, artist, track_name) rows that share a canonical key.
+
+    A task is (key, search_artist, search_track, rows): one lookup serves every row in it.
+    """
+    _, artist, track_name = rows[0]
+    return (canonical_key(artist, track_name), *search_terms(artist, track_name), rows)
+
+
+class WorkQueue:
+    """Thread-safe queue of tasks shared by all workers; the first element of a task is its unique key.
+
+    Workers lease tasks until the queue is drained, so a slow worker never holds up a fixed slice.
+    Tasks that fail are put back at the end of the queue until their retry budget is spent.
+    Blocked tasks are parked until a given time instead, without using up their retries.
+    `tasks` may be a lazy iterator, which is then only read as workers lease; pass its length as total.
+    """
+
+    def __init__(self, tasks, max_retries=2, total=None, max_parks=20):
+        self.source = iter(tasks)
+        self.pending = deque()
+        self.parked = []  # Heap of (ready_at, sequence, task)
+        self.sequence = itertools.count()
+        self.max_parks = max_parks
+        self.parks = {}  # task key -> times parked so far
+        if total is None:
+            self.pending.extend(self.source)
+            total = len(self.pending)
+        self.total = total
+        self.max_retries = max_retries
+        self.failures = {}  # task key -> failed attempts so far
+        self.in_flight = 0
+        self.finished = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def lease(self, n=1, block=True):
+        """Lease up to n tasks. Returns an empty list once every task is finished or the queue is closed.
+
+        While the queue is empty but other tasks are still in flight, a blocking lease waits because
+        a failing task may be requeued; a non-blocking lease returns an empty list straight away.
+        """
+        with self.cond:
+            self._refill(n)
+            while block and not self.pending and (self.in_flight or self.parked) and not self.closed:
+                self.cond.wait(self._next_ready_in())
+                self._refill(n)
+            if self.closed or not self.pending:
+                return []
+            tasks = [self.pending.popleft() for _ in range(min(n, len(self.pending)))]
+            self.in_flight += len(tasks)
+            return tasks
+
+    def _next_ready_in(self):
+        return max(self.parked[0][0] - time.monotonic(), 0) if self.parked else None
+
+    def _refill(self, n):
+        """Move parked tasks that are ready back in, then pull from the lazy source until n are pending"""
+        now = time.monotonic()
+        while self.parked and self.parked[0][0] <= now:
+            self.pending.append(heapq.heappop(self.parked)[2])
+        while self.source is not None and len(self.pending) < n:
+            try:
+                self.pending.append(next(self.source))
+            except StopIteration:
+                self.source = None
+
+    def complete(self, task):
+        with self.cond:
+            self.in_flight -= 1
+            self.finished += 1
+            self.failures.pop(task[0], None)
+            self.parks.pop(task[0], None)
+            self.cond.notify_all()
+
+    def fail(self, task):
+        """Requeue a failed task. Returns False once its retries are used up; it then counts as finished."""
+        with self.cond:
+            attempts = self.failures.get(task[0], 0) + 1
+            if attempts > self.max_retries:
+                self.in_flight -= 1
+                self.finished += 1
+                self.failures.pop(task[0], None)
+                self.parks.pop(task[0], None)
+                self.cond.notify_all()
+                return False
+            self.failures[task[0]] = attempts
+            self.pending.append(task)
+            self.in_flight -= 1
+            self.cond.notify_all()
+            return True
+
+    def park(self, task, delay):
+        """Hold a blocked task back for delay seconds. Returns False once it was parked max_parks times."""
+        with self.cond:
+            parks = self.parks.get(task[0], 0) + 1
+            if parks > self.max_parks:
+                return False
+            self.parks[task[0]] = parks
+            heapq.heappush(self.parked, (time.monotonic() + delay, next(self.sequence), task))
+            self.in_flight -= 1
+            self.cond.notify_all()
+            return True
+
+    def next_ready_in(self):
+        """Seconds until the next parked task is ready, or None if nothing is parked"""
+        with self.cond:
+            return self._next_ready_in()
+
+    def release(self, tasks):
+        """Return leased tasks that were not processed, e.g. when a worker is stopped"""
+        with self.cond:
+            self.pending.extendleft(reversed(tasks))
+            self.in_flight -= len(tasks)
+            self.cond.notify_all()
+
+    def is_done(self):
+        with self.cond:
+            self._refill(1)
+            return self.closed or (not self.pending and not self.in_flight and not self.parked)
+
+    def close(self):
+        """Stop handing out tasks and wake up every waiting worker"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
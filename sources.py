@@ -0,0 +1,248 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+from engines import GOOGLE_URL, Lyrics, extract_lyrics_from_html, search_query_for, search_url
+from metrics import METRICS
+from ratecontrol import BlockedError, classify, is_block_page
+
+LYRICS_OVH_URL = "https://api.lyrics.ovh"
+
+# Sources keep their declared order until each has had this many lookups
+WARMUP_LOOKUPS = 20
+# Weight of the latest lookup in a source's health, the moving share of lookups without errors
+HEALTH_WEIGHT = 0.1
+
+
+class Source:
+    """One place lyrics can come from: how to request a song and how to read the response.
+
+    request() returns (url, extra headers). parse() returns the lyrics, or None if the source
+    answered but has no lyrics for the song; it raises BlockedError when the source refuses us and
+    any other exception for errors worth retrying. Sources hold no connections, so the same source
+    works with the requests engine and the asyncio crawler.
+    """
+
+    name = ""
+
+    def request(self, artist, track_name, lang):
+        raise NotImplementedError
+
+    def parse(self, status, text, url, lang):
+        raise NotImplementedError
+
+
+def check_status(status, url):
+    if status == 429:
+        raise BlockedError(f"Blocked with HTTP 429 at {url}")
+    if status >= 400:
+        raise RuntimeError(f"HTTP {status} at {url}")
+
+
+class GoogleSource(Source):
+    """The lyrics knowledge panel of the Google results page"""
+
+    name = "google"
+
+    def __init__(self, base_url=GOOGLE_URL):
+        self.base_url = base_url
+
+    def request(self, artist, track_name, lang):
+        return search_url(self.base_url, search_query_for(artist, track_name), lang), None
+
+    def parse(self, status, text, url, lang):
+        if is_block_page(text, url):
+            raise BlockedError(f"Blocked with HTTP {status} at {url}")
+        check_status(status, url)
+        return extract_lyrics_from_html(text, lang)
+
+
+class LyricsOvhSource(Source):
+    """The free lyrics.ovh API, looked up by exact artist and title (original lyrics only)"""
+
+    name = "lyrics.ovh"
+
+    def __init__(self, base_url=LYRICS_OVH_URL):
+        self.base_url = base_url
+
+    def request(self, artist, track_name, lang):
+        url = f"{self.base_url.rstrip('/')}/v1/{quote(artist, safe='')}/{quote(track_name, safe='')}"
+        return url, {"Accept": "application/json"}
+
+    def parse(self, status, text, url, lang):
+        if status == 404:
+            return None
+        check_status(status, url)
+        lyrics = (json.loads(text).get("lyrics") or "").replace("\r\n", "\n").strip()
+        # Some songs start with a French "Paroles de la chanson <title> par <artist>" heading
+        if lyrics.startswith("Paroles de la chanson"):
+            lyrics = lyrics.partition("\n")[2].strip()
+        return lyrics or None
+
+
+# Source names accepted by create_sources(), in their default order
+SOURCES = {GoogleSource.name: GoogleSource, LyricsOvhSource.name: LyricsOvhSource}
+
+
+def create_sources(names=None, base_url=GOOGLE_URL):
+    """Build sources by name, highest priority first; base_url is used for Google"""
+    sources = []
+    for name in names or [GoogleSource.name]:
+        if name not in SOURCES:
+            raise ValueError(f"Unknown lyrics source: {name}")
+        sources.append(GoogleSource(base_url) if name == GoogleSource.name else SOURCES[name]())
+    return sources
+
+
+class SourceStats:
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.health = 1.0
+
+    def record(self, lyrics, error):
+        self.lookups += 1
+        if lyrics:
+            self.hits += 1
+        self.health += HEALTH_WEIGHT * ((0.0 if error else 1.0) - self.health)
+
+    def score(self):
+        """Expected share of lookups that end with lyrics"""
+        return self.hits / self.lookups * self.health if self.lookups else 0.0
+
+
+class SourcePipeline:
+    """Ask several sources for a song's lyrics and stop at the first one that has them.
+
+    Sources are tried in the given priority order, reordered by their observed hit rate times their
+    health once every source has WARMUP_LOOKUPS lookups, so the source most likely to answer goes first and
+    a failing one drops back. With parallel=True all sources are asked at once instead. A song
+    only counts as not found when every source answered; otherwise the error of the highest ranked
+    failing source is raised, so the worker retries it. Shared by the threads of an engine.
+
+    The worker's ratecontrol.RateController covers the first request of a lookup; with rate given,
+    every further source request takes a token of its own, so --rate bounds the real request rate.
+    """
+
+    def __init__(self, sources, lang, parallel=False, threads=10, rate=None):
+        self.sources = list(sources)
+        self.rate = rate
+        self.lang = lang
+        self.parallel = parallel and len(self.sources) > 1
+        self.stats = {source.name: SourceStats() for source in self.sources}
+        self.lock = threading.Lock()
+        self.executor = None
+        if self.parallel:
+            self.executor = ThreadPoolExecutor(max_workers=threads * len(self.sources),
+                                               thread_name_prefix="lyrics-source")
+
+    def ordered(self):
+        with self.lock:
+            if any(stats.lookups < WARMUP_LOOKUPS for stats in self.stats.values()):
+                return self.sources
+            scores = {name: stats.score() for name, stats in self.stats.items()}
+        # sorted() is stable, so sources with equal scores keep their priority order
+        return sorted(self.sources, key=lambda source: -scores[source.name])
+
+    def record(self, source, lyrics, error):
+        with self.lock:
+            self.stats[source.name].record(lyrics, error)
+        METRICS.count(f"{source.name}:{classify(lyrics, error)}")
+
+    def finish(self, source, status, text, url):
+        try:
+            with METRICS.timed("extract"):
+                lyrics = source.parse(status, text, url, self.lang)
+        except Exception as e:
+            self.record(source, None, e)
+            return None, e
+        self.record(source, lyrics, None)
+        return (Lyrics(lyrics, source.name) if lyrics else None), None
+
+    def ask(self, source, artist, track_name, fetch):
+        """Return (lyrics, error) of one source; fetch(url, headers) returns (status, text, final url)"""
+        url, headers = source.request(artist, track_name, self.lang)
+        try:
+            with METRICS.timed("http_fetch"):
+                status, text, final_url = fetch(url, headers)
+        except Exception as e:
+            self.record(source, None, e)
+            return None, e
+        return self.finish(source, status, text, final_url)
+
+    async def ask_async(self, source, artist, track_name, fetch):
+        url, headers = source.request(artist, track_name, self.lang)
+        try:
+            with METRICS.timed("http_fetch"):
+                status, text, final_url = await fetch(url, headers)
+        except Exception as e:
+            self.record(source, None, e)
+            return None, e
+        return self.finish(source, status, text, final_url)
+
+    @staticmethod
+    def resolve(answers):
+        """Return the lyrics from (lyrics, error) answers in rank order, raise the first error, or None"""
+        for lyrics, error in answers:
+            if lyrics:
+                return lyrics
+        for lyrics, error in answers:
+            if error:
+                raise error
+        return None
+
+    def lookup(self, artist, track_name, fetch):
+        sources = self.ordered()
+        if not self.parallel:
+            answers = []
+            for source in sources:
+                if answers and self.rate:
+                    self.rate.charge()
+                answers.append(self.ask(source, artist, track_name, fetch))
+                if answers[-1][0]:
+                    break
+            return self.resolve(answers)
+        if self.rate:
+            for _ in sources[1:]:
+                self.rate.charge()
+        futures = [self.executor.submit(self.ask, source, artist, track_name, fetch) for source in sources]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if any(future.result()[0] for future in done):
+                for future in pending:
+                    future.cancel()  # Requests already sent finish in the background
+                break
+        return self.resolve([future.result() for future in futures if future.done() and not future.cancelled()])
+
+    async def lookup_async(self, artist, track_name, fetch):
+        sources = self.ordered()
+        if not self.parallel:
+            answers = []
+            for source in sources:
+                if answers and self.rate:
+                    await self.rate.charge_async()
+                answers.append(await self.ask_async(source, artist, track_name, fetch))
+                if answers[-1][0]:
+                    break
+            return self.resolve(answers)
+        if self.rate:
+            for _ in sources[1:]:
+                await self.rate.charge_async()
+        tasks = [asyncio.ensure_future(self.ask_async(source, artist, track_name, fetch)) for source in sources]
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(task.result()[0] for task in done):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self.resolve([task.result() for task in tasks if task.done() and not task.cancelled()])
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from normalize import canonical_key
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+STATE_DIR = "crawl_state"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    row_id INTEGER PRIMARY KEY,
+    artist TEXT NOT NULL,
+    track_name TEXT NOT NULL,
+    job_key TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    latency REAL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, row_id);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (job_key);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def state_path_for(input_path, shard=None):
+    """Return the job store path for an input CSV, unique per absolute path and (index, count) shard"""
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    digest = hashlib.sha1(os.path.abspath(input_path).encode("utf-8")).hexdigest()[:8]
+    if shard:
+        stem += f"-shard{shard[0]}of{shard[1]}"
+    return os.path.join(STATE_DIR, f"{stem}-{digest}.sqlite")
+
+
+class JobStore:
+    """SQLite record of every input row: status, attempts, latency and result.
+
+    Results are committed in small batches by writer.ResultWriter, so a crash loses at most the
+    last few seconds of work, and a restarted run only crawls rows that are not done yet.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if "source" not in self.columns():
+            # Added after the first release; older stores get it on their next run
+            with self.conn:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN source TEXT")
+
+    def get_meta(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def columns(self, schema="main"):
+        return [row[1] for row in self.conn.execute(f"PRAGMA {schema}.table_info(jobs)")]
+
+    def sync_rows(self, rows, chunk_size=10000):
+        """Register (row_id, artist, track_name) rows. Rows whose key changed since the last run are reset."""
+        sql = (
+            "INSERT INTO jobs (row_id, artist, track_name, job_key) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (row_id) DO UPDATE SET artist = excluded.artist, track_name = excluded.track_name, "
+            "job_key = excluded.job_key, status = 'pending', attempts = 0, latency = NULL, result = NULL, "
+            "error = NULL, source = NULL WHERE jobs.job_key != excluded.job_key"
+        )
+        chunk = []
+        for row_id, artist, track_name in rows:
+            chunk.append((int(row_id), str(artist), str(track_name), canonical_key(artist, track_name)))
+            if len(chunk) >= chunk_size:
+                self._executemany(sql, chunk)
+                chunk = []
+        if chunk:
+            self._executemany(sql, chunk)
+
+    def _executemany(self, sql, params):
+        with self.lock, self.conn:
+            self.conn.executemany(sql, params)
+
+    def pending_count(self):
+        """Return (rows, distinct keys) still to be crawled"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT job_key) FROM jobs WHERE status != ?", (DONE,)
+            ).fetchone()
+
+    def iter_pending_groups(self, page_size=5000):
+        """Stream the pending rows as lists of (row_id, artist, track_name) sharing one key.
+
+        Rows are read in key order a page at a time, so memory does not depend on the dataset size.
+        """
+        group, last = [], ("", -1)
+        while True:
+            with self.lock:
+                page = self.conn.execute(
+                    "SELECT job_key, row_id, artist, track_name FROM jobs WHERE status != ? "
+                    "AND (job_key, row_id) > (?, ?) ORDER BY job_key, row_id LIMIT ?",
+                    (DONE, last[0], last[1], page_size),
+                ).fetchall()
+            if not page:
+                break
+            for key, row_id, artist, track_name in page:
+                if group and key != last[0]:
+                    yield group
+                    group = []
+                group.append((row_id, artist, track_name))
+                last = (key, row_id)
+        if group:
+            yield group
+
+    def done_results(self, page_size=5000):
+        """Stream (artist, track_name, result) for every finished row"""
+        last = -1
+        while True:
+            with self.lock:
+                page = self.conn.execute(
+                    "SELECT row_id, artist, track_name, result FROM jobs WHERE status = ? AND row_id > ? "
+                    "ORDER BY row_id LIMIT ?",
+                    (DONE, last, page_size),
+                ).fetchall()
+            if not page:
+                break
+            for row_id, artist, track_name, result in page:
+                yield artist, track_name, result
+            last = page[-1][0]
+
+    def results_between(self, first, last):
+        """Return {row_id: (artist, track_name, status, result, source)} for first <= row_id < last"""
+        with self.lock:
+            return {
+                row[0]: row[1:]
+                for row in self.conn.execute(
+                    "SELECT row_id, artist, track_name, status, result, source FROM jobs "
+                    "WHERE row_id >= ? AND row_id < ?",
+                    (first, last),
+                )
+            }
+
+    def record_batch(self, done, failed):
+        """Record finished and failed lookups in one transaction.
+
+        done holds (row_ids, result, latency, source) and failed holds (row_ids, error, latency, final);
+        rows of non-final failures stay pending so they are retried.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            # Failures first: a row that failed and was then found within one batch must end up done
+            self.conn.executemany(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, latency = ?, error = ?, updated_at = ? "
+                "WHERE row_id = ?",
+                [(FAILED if final else PENDING, latency, error, now, int(row_id))
+                 for row_ids, error, latency, final in failed for row_id in row_ids],
+            )
+            self.conn.executemany(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, latency = ?, result = ?, error = NULL, "
+                "updated_at = ?, source = ? WHERE row_id = ?",
+                [(DONE, latency, result, now, source, int(row_id))
+                 for row_ids, result, latency, source in done for row_id in row_ids],
+            )
+
+    def merge_from(self, path):
+        """Copy the rows of another job store, e.g. one shard of a multi-machine run, into this one.
+
+        Rows already done here are kept; every other row is replaced by the other store's copy.
+        """
+        with self.lock:
+            self.conn.execute("ATTACH DATABASE ? AS other", (path,))
+            try:
+                # Stores from older versions lack some columns, which stay NULL
+                columns = ", ".join(column for column in self.columns("other") if column in self.columns())
+                with self.conn:
+                    self.conn.execute(
+                        f"INSERT OR REPLACE INTO jobs ({columns}) SELECT {columns} FROM other.jobs AS o "
+                        "WHERE NOT EXISTS (SELECT 1 FROM jobs AS j WHERE j.row_id = o.row_id AND j.status = ?)",
+                        (DONE,),
+                    )
+            finally:
+                self.conn.execute("DETACH DATABASE other")
+
+    def total_rows(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def counts(self):
+        """Return a {status: row count} dict"""
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
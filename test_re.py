@@ -11,7 +11,8 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait as wait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+
+from engines import resolve_driver_path
 
 
 class LyricsScraperGUI(QWidget):
@@ -113,7 +114,7 @@ def setup_driver():
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_argument("--remote-allow-origins=*")
     options.add_argument("--disable-blink-features=AutomationControlled")
-    service = Service(ChromeDriverManager().install())
+    service = Service(resolve_driver_path())  # 只解析一次驱动路径并缓存
     driver = webdriver.Chrome(service=service, options=options)
 
     return driver
@@ -150,25 +151,23 @@ def scrape_lyrics(batch):
 def process_in_batches(input_csv, output_csv, max_workers):
     """ 多进程批量爬取 """
     df = pd.read_csv(input_csv)
-    batch_size = min(500, len(df) // max_workers)
+    batch_size = max(1, min(500, len(df) // max_workers))
     batches = [df.iloc[i:i+batch_size] for i in range(0, len(df), batch_size)]
+    total = len(df)
+    progress = [0]
 
-    with multiprocessing.Manager() as manager:
-        progress = manager.Value('i', 0)
-        total = len(df)
-
-        def update_progress(_):
-            with progress.get_lock():
-                progress.value += batch_size
-                print(f"Progress: {progress.value}/{total}")
+    # Callbacks run on a thread of this process, so a plain counter is enough
+    def update_progress(batch_result):
+        progress[0] += len(batch_result)
+        print(f"Progress: {progress[0]}/{total}")
 
-        with multiprocessing.Pool(max_workers) as pool:
-            results = [pool.apply_async(scrape_lyrics, args=(batch,), callback=update_progress) for batch in batches]
-            final_batches = [r.get() for r in results]
+    with multiprocessing.Pool(max_workers) as pool:
+        results = [pool.apply_async(scrape_lyrics, args=(batch,), callback=update_progress) for batch in batches]
+        final_batches = [r.get() for r in results]
 
-        final_df = pd.concat(final_batches, ignore_index=True)
-        final_df.to_csv(output_csv, index=False, encoding='utf-8-sig')
-        print(f"Scraping completed. Results saved to {output_csv}")
+    final_df = pd.concat(final_batches, ignore_index=True)
+    final_df.to_csv(output_csv, index=False, encoding='utf-8-sig')
+    print(f"Scraping completed. Results saved to {output_csv}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,14 @@
+import traceback
+
+from logs import log_error
+
+MAX_FILENAME_LENGTH = 150
+
+
+def sanitize_filename(name):
+    """Remove illegal characters and cut overly long names to ensure filename validity"""
+    try:
+        return "".join(c for c in name if c.isalnum() or c in (" ", "-", "_"))[:MAX_FILENAME_LENGTH].rstrip()
+    except Exception as e:
+        log_error(f"sanitize_filename error: {e}\n{traceback.format_exc()}")
+        return "unknown"
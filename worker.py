@@ -0,0 +1,466 @@
+import os
+import time
+import traceback
+
+from cache import LyricsCache
+from engines import BROWSER_ENGINES, GOOGLE_URL, DriverPool, HttpEngine, create_engine
+from ingest import iter_rows, shard_rows
+from logs import log_error
+from metrics import METRICS, MetricsExporter
+from output import TREE, open_output
+from ratecontrol import BLOCKED, RateController, classify, error_for
+from scheduler import WorkQueue, make_task
+from store import JobStore, state_path_for
+from writer import ResultWriter
+
+
+class LookupWorker:
+    """Crawl loop of one worker, free of any GUI code so the GUI threads and the command line share it.
+
+    Progress and log lines are passed to on_progress(worker_id, done, total) and
+    on_log(worker_id, message).
+    """
+
+    LEASE_SIZE = 1  # Tasks taken from the shared queue at a time
+    PARK_DELAY = 10  # Minimum seconds a blocked task waits before it is tried again
+
+    def __init__(self, worker_id, work_queue, lang, writer, engine_name="chrome", http_engine=None,
+                 driver_pool=None, cache=None, rate=None, on_progress=None, on_log=None, base_url=GOOGLE_URL):
+        self.worker_id = worker_id
+        self.work_queue = work_queue  # scheduler.WorkQueue shared by all workers
+        self.lang = lang  # Official language: "English" or "Chinese"
+        self.writer = writer  # writer.ResultWriter persisting results off this thread
+        self.engine_name = engine_name  # One of engines.ENGINES
+        self.http_engine = http_engine  # Shared HTTP engine, owned by the CrawlJob
+        self.driver_pool = driver_pool  # Shared Chrome pool, owned by the CrawlJob
+        self.cache = cache  # cache.LyricsCache shared across runs, optional
+        self.rate = rate  # ratecontrol.RateController shared by all workers, optional
+        self.on_progress = on_progress
+        self.on_log = on_log
+        self.base_url = base_url
+        self.total = work_queue.total
+        self.done = 0
+        self.engine = None
+        self._is_running = True
+
+    def log(self, message):
+        if self.on_log:
+            self.on_log(self.worker_id, message)
+
+    def run(self):
+        try:
+            self.engine = create_engine(self.engine_name, self.lang, self.http_engine, self.driver_pool,
+                                        self.base_url)
+
+            # Keep pulling tasks until the shared queue is drained
+            while self._is_running:
+                tasks = self.work_queue.lease(self.LEASE_SIZE)
+                if not tasks:
+                    break
+                for i, task in enumerate(tasks):
+                    if not self._is_running:
+                        self.work_queue.release(tasks[i:])
+                        break
+                    self.process_task(task)
+
+            if not self._is_running:
+                self.log("Exit request received, terminating scraping early.")
+        except Exception as e:
+            self.log(f"Run error: {e}")
+            log_error(f"Worker run error: {e}\n{traceback.format_exc()}", worker=self.worker_id, stage="run")
+        finally:
+            self.cleanup()
+
+    def process_task(self, task):
+        """Look up one task (see scheduler.make_task) and record the result for all of its rows"""
+        _, artist, track_name, _ = task
+        settled = False  # Whether the task went back to the work queue (completed, failed, parked or released)
+        try:
+            hit, lyrics = self.cache_lookup(task)
+            if hit:
+                settled = True
+                self.finish_cached(task, lyrics)
+                return
+            if self.rate:
+                with METRICS.timed("rate_wait"):
+                    granted = self.rate.acquire()
+                if not granted:
+                    # Stopped while waiting out a pause: the task goes back unlooked-up
+                    settled = True
+                    self.work_queue.release([task])
+                    return
+            started = time.perf_counter()
+            lyrics, error = None, None
+            try:
+                lyrics = self.engine.lookup(artist, track_name)
+            except Exception as e:
+                error = e
+            latency = time.perf_counter() - started
+            if self.rate:
+                self.rate.release(classify(lyrics, error))
+            self.record(task, lyrics, error, latency)
+            settled = True
+            if error:
+                self.handle_failure(task, error, latency)
+            else:
+                self.handle_success(task, lyrics, latency)
+        except Exception as inner_e:
+            self.log(f"Loop error: {inner_e}")
+            log_error(f"Worker loop error: {inner_e}\n{traceback.format_exc()}", worker=self.worker_id,
+                      rows=[row[0] for row in task[3]], song=f"{artist} - {track_name}", stage="lookup")
+            if not settled:
+                self.abandon(task, inner_e)
+
+    def abandon(self, task, error):
+        """Fail a task whose processing raised; left in flight, it would keep every blocking lease waiting"""
+        try:
+            self.handle_failure(task, error, 0.0)
+        except Exception as e:
+            log_error(f"Worker abandon error: {e}\n{traceback.format_exc()}", worker=self.worker_id,
+                      rows=[row[0] for row in task[3]], stage="lookup")
+
+    def cache_lookup(self, task):
+        """Return (hit, lyrics) from the lyrics cache; a cache that cannot be read counts as a miss"""
+        if not self.cache:
+            return False, None
+        try:
+            with METRICS.timed("cache_get"):
+                return self.cache.get(task[0])
+        except Exception as e:
+            log_error(f"Lyrics cache read error: {e}", worker=self.worker_id, stage="cache")
+            return False, None
+
+    def serve_from_cache(self, task):
+        """Finish a task from the lyrics cache without a network call; returns True on a hit"""
+        hit, lyrics = self.cache_lookup(task)
+        if not hit:
+            return False
+        self.finish_cached(task, lyrics)
+        return True
+
+    def finish_cached(self, task, lyrics):
+        """Record a task answered by the lyrics cache"""
+        METRICS.count("cached", worker=self.worker_id)
+        METRICS.count("rows", len(task[3]), worker=self.worker_id)
+        self.work_queue.complete(task)
+        self.writer.done(task, lyrics, 0.0, cached=True)
+        self.report(task, "(cached)")
+
+    def record(self, task, lyrics, error, latency):
+        """Count a lookup under its outcome and time it; rows are only counted once they are finished"""
+        outcome = classify(lyrics, error)
+        METRICS.observe("lookup", latency, worker=self.worker_id)
+        METRICS.count(outcome, worker=self.worker_id)
+        if error is None:
+            METRICS.count("rows", len(task[3]), worker=self.worker_id)
+
+    def handle_reported(self, task, lyrics, outcome, message, latency):
+        """Record a lookup done elsewhere (a worker process or a remote worker) from its outcome and message"""
+        error = error_for(outcome, message) if outcome else None
+        try:
+            self.record(task, lyrics, error, latency)
+            if self.rate:
+                self.rate.count(classify(lyrics, error))
+        except Exception as e:
+            # Still settle the task below, or the work queue would wait for it forever
+            log_error(f"Worker count error: {e}\n{traceback.format_exc()}", worker=self.worker_id, stage="lookup")
+        if error:
+            self.handle_failure(task, error, latency)
+        else:
+            self.handle_success(task, lyrics, latency)
+
+    def handle_success(self, task, lyrics, latency):
+        """Record a lookup that completed; lyrics is None when the page had no lyrics"""
+        self.work_queue.complete(task)
+        self.writer.done(task, lyrics, latency)
+        self.report(task)
+
+    def handle_failure(self, task, error, latency):
+        """Park a blocked task until the block cools down, or requeue a failed one until its retries are used up.
+
+        Rows that keep failing get no lyrics file and stay failed in the job store, so the next run
+        tries them again.
+        """
+        _, artist, track_name, _ = task
+        if classify(None, error) == BLOCKED:
+            delay = max(self.rate.pause_remaining() if self.rate else 0, self.PARK_DELAY)
+            if self.work_queue.park(task, delay):
+                self.log(f"Blocked on {artist} - {track_name}, parked for {delay:.0f}s")
+                return
+        requeued = self.work_queue.fail(task)
+        self.writer.failed(task, error, latency, final=not requeued)
+        if requeued:
+            self.log(f"Error processing {artist} - {track_name}, requeued: {error}")
+            return
+        self.log(f"Error processing {artist} - {track_name}: {error}")
+        # One record per song that ran out of retries; the attempts before it are in the job store
+        log_error("Lookup failed after all retries", worker=self.worker_id, rows=[row[0] for row in task[3]],
+                  song=f"{artist} - {track_name}", stage="lookup", outcome=classify(None, error), error=str(error))
+        self.report(task, "(failed)")
+
+    def report(self, task, note=""):
+        """Count a finished task and pass on the progress"""
+        _, artist, track_name, rows = task
+        self.done += 1
+        if self.on_progress:
+            self.on_progress(self.worker_id, self.done, self.total)
+        details = f" ({len(rows)} rows)" if len(rows) > 1 else ""
+        if note:
+            details += " " + note
+        self.log(f"Processed {self.done} - {artist} - {track_name}{details}")
+
+    def cleanup(self):
+        try:
+            # The shared HTTP engine is closed by the CrawlJob once every worker is done
+            if self.engine and self.engine is not self.http_engine:
+                self.engine.close()
+            self.engine = None
+        except Exception as e:
+            log_error(f"Worker cleanup error: {e}\n{traceback.format_exc()}", worker=self.worker_id, stage="cleanup")
+
+    def stop(self):
+        """Ask the worker to exit early"""
+        self._is_running = False
+
+
+class AsyncLookupWorker(LookupWorker):
+    """Run the whole queue on one asyncio event loop with `concurrency` requests in flight"""
+
+    def __init__(self, worker_id, work_queue, lang, writer, concurrency, cache=None, rate=None,
+                 on_progress=None, on_log=None, base_url=GOOGLE_URL, sources=None, parallel_sources=False):
+        super().__init__(worker_id, work_queue, lang, writer, "http", cache=cache, rate=rate,
+                         on_progress=on_progress, on_log=on_log, base_url=base_url)
+        self.concurrency = concurrency
+        self.sources = sources
+        self.parallel_sources = parallel_sources
+
+    def create_pipeline(self):
+        from sources import SourcePipeline, create_sources
+
+        return SourcePipeline(create_sources(self.sources, self.base_url), self.lang, self.parallel_sources,
+                              rate=self.rate)
+
+    def run(self):
+        try:
+            from async_crawl import run_crawl
+
+            # Kept across passes so the sources' hit rates and health carry over
+            pipeline = self.create_pipeline()
+            try:
+                # Failed tasks are requeued and blocked ones parked, so crawl again until nothing is left
+                while self._is_running and not self.work_queue.is_done():
+                    run_crawl(self.iter_tasks(), self.lang, self.concurrency, self.handle_result,
+                              base_url=self.base_url, should_stop=lambda: not self._is_running, rate=self.rate,
+                              pipeline=pipeline)
+                    wait = self.work_queue.next_ready_in()
+                    if wait:
+                        time.sleep(min(wait, 1))
+            finally:
+                pipeline.close()
+            if not self._is_running:
+                self.log("Exit request received, terminating scraping early.")
+        except Exception as e:
+            self.log(f"Run error: {e}")
+            log_error(f"Worker run error: {e}\n{traceback.format_exc()}", worker=self.worker_id, stage="run")
+
+    def iter_tasks(self):
+        # Never block: the tasks still in flight all belong to this event loop
+        while True:
+            tasks = self.work_queue.lease(1, block=False)
+            if not tasks:
+                return
+            if not self.serve_from_cache(tasks[0]):
+                yield tasks[0]
+
+    def handle_result(self, task, lyrics, error, latency):
+        settled = False
+        try:
+            self.record(task, lyrics, error, latency)
+            settled = True
+            if error:
+                self.handle_failure(task, error, latency)
+                return
+            self.handle_success(task, lyrics, latency)
+        except Exception as e:
+            log_error(f"Worker result error: {e}\n{traceback.format_exc()}", worker=self.worker_id,
+                      rows=[row[0] for row in task[3]], song=f"{task[1]} - {task[2]}", stage="lookup")
+            if not settled:
+                self.abandon(task, e)
+
+
+class CrawlJob:
+    """One crawl of an input CSV: shared engines, job store, lyrics cache, output, writer, queue and rate.
+
+    engine_name is one of engines.ENGINES, "async", or "remote" for a coordinator.Coordinator, which
+    starts no engines because its workers run on other machines. shard is an (index, count) pair from
+    ingest.parse_shard to crawl only that slice of the dataset. With processes > 1 the lookups run
+    in that many worker processes (see procpool.ProcessPool), which split max_workers and max_rate.
+    sources names the lyrics sources of the HTTP engines in priority order (see sources.SOURCES).
+    """
+
+    def __init__(self, input_path, lang="Chinese", engine_name="chrome", max_workers=5, max_rate=5.0,
+                 output_kind=TREE, output_path=None, shard=None, use_cache=True, base_url=GOOGLE_URL,
+                 processes=1, sources=None, parallel_sources=False):
+        self.input_path = input_path
+        self.lang = lang
+        self.engine_name = engine_name
+        self.max_workers = max(max_workers, 1)
+        self.max_rate = max(max_rate, 0.2)
+        self.output_kind = output_kind
+        self.output_path = output_path
+        self.shard = shard
+        self.use_cache = use_cache
+        self.base_url = base_url
+        self.processes = max(processes, 1)
+        self.sources = sources
+        self.parallel_sources = parallel_sources
+        self.http_engine = None
+        self.driver_pool = None
+        self.store = None
+        self.cache = None
+        self.output = None
+        self.writer = None
+        self.work_queue = None
+        self.rate = None
+        self.exporter = None
+        self.total_rows = 0
+        self.pending_rows = 0
+        self.pending_keys = 0
+        self.rewritten_rows = 0  # Rows of earlier runs written again because the output changed
+
+    def open(self):
+        """Start the engines and the writer, sync the CSV into the job store and build the work queue"""
+        # Before any browser launches, so their driver_start times are kept
+        METRICS.reset()
+        # Before the engines, which charge it for the extra source requests of a lookup
+        self.rate = RateController(self.max_rate, concurrency=min(self.max_workers, 10),
+                                   max_concurrency=self.max_workers)
+        # Worker processes start their own engines
+        if self.processes == 1 and self.engine_name in ("http", "auto"):
+            self.http_engine = HttpEngine(self.lang, self.base_url, pool_size=self.max_workers,
+                                          sources=self.sources, parallel_sources=self.parallel_sources,
+                                          rate=self.rate)
+        if self.processes == 1 and self.engine_name in BROWSER_ENGINES:
+            self.driver_pool = DriverPool(self.max_workers, fast=self.engine_name == "headless")
+            if self.engine_name != "auto":
+                # Browsers launch in the background while the rest is being set up; "auto" only
+                # launches them on its first fallback to Chrome
+                self.driver_pool.start()
+
+        # The CSV is streamed into the job store in chunks, never loaded whole.
+        # Rows already finished by an earlier run of the same file are skipped.
+        self.store = JobStore(state_path_for(self.input_path, self.shard))
+        if self.use_cache:
+            # Browser engines only read Google's results page, whatever the sources
+            sources = None if self.engine_name in ("chrome", "headless") else self.sources
+            self.cache = LyricsCache(lang=self.lang, sources=sources)
+        self.output = open_output(self.output_kind, self.output_path)
+        self.rewritten_rows = self.sync_output()
+        self.writer = ResultWriter(self.output, self.store, self.cache)
+        self.writer.start()
+        rows = iter_rows(self.input_path)
+        if self.shard:
+            rows = shard_rows(rows, *self.shard)
+        self.store.sync_rows(rows)
+        self.total_rows = self.store.total_rows()
+        self.pending_rows, self.pending_keys = self.store.pending_count()
+        # Rows with the same canonical artist/track share one lookup; tasks are read lazily
+        tasks = (make_task(group) for group in self.store.iter_pending_groups())
+        self.work_queue = WorkQueue(tasks, total=self.pending_keys)
+        # Shared by every worker: starts with at most 10 lookups in flight and adapts to blocks
+        # From here on, stage latencies and outcomes are written next to the job store every 10 seconds;
+        # rows/s leaves out the time spent syncing the CSV
+        METRICS.restart_clock()
+        self.exporter = MetricsExporter(METRICS, os.path.splitext(self.store.path)[0] + "-metrics")
+        self.exporter.start()
+
+    def sync_output(self, chunk_size=5000):
+        """Write the rows finished by earlier runs into the output if it is not the one they went to.
+
+        The job store is kept per CSV, so re-running it with another --output or --output-path would
+        otherwise skip every finished row and leave the new output without them. Returns the rows written.
+        """
+        target = f"{self.output_kind}:{os.path.abspath(self.output.path)}"
+        if self.store.get_meta("output") == target:
+            return 0
+        written = 0
+        items = []
+        for item in self.store.done_results():
+            items.append(item)
+            if len(items) >= chunk_size:
+                self.output.write_many(items)
+                written += len(items)
+                items = []
+        if items:
+            self.output.write_many(items)
+            written += len(items)
+        self.store.set_meta("output", target)
+        return written
+
+    def create_workers(self, on_progress=None, on_log=None):
+        """Return the workers to run, each on its own thread"""
+        if self.processes > 1:
+            from procpool import ProcessPool
+
+            pool = ProcessPool(self, self.processes, on_progress, on_log)
+            pool.start()
+            return pool.workers
+        if self.engine_name == "async":
+            # A single event loop replaces the thread pool; max_workers is the request concurrency
+            return [AsyncLookupWorker(0, self.work_queue, self.lang, self.writer, self.max_workers,
+                                      self.cache, self.rate, on_progress, on_log, self.base_url,
+                                      self.sources, self.parallel_sources)]
+        worker_count = max(1, min(self.max_workers, self.work_queue.total))
+        return [
+            LookupWorker(i, self.work_queue, self.lang, self.writer, self.engine_name, self.http_engine,
+                         self.driver_pool, self.cache, self.rate, on_progress, on_log, self.base_url)
+            for i in range(worker_count)
+        ]
+
+    def stop(self):
+        """Stop handing out tasks and waiting for request slots"""
+        if self.work_queue:
+            self.work_queue.close()
+        if self.rate:
+            self.rate.stop()
+
+    def close_engines(self):
+        """Close the HTTP session and browser pool shared by the workers"""
+        try:
+            if self.http_engine:
+                self.http_engine.close()
+                self.http_engine = None
+            if self.driver_pool:
+                self.driver_pool.close()
+                self.driver_pool = None
+        except Exception as e:
+            log_error(f"close_engines error: {e}\n{traceback.format_exc()}", stage="cleanup")
+
+    def close_state(self):
+        """Flush the result writer, then close the output backend, job store and lyrics cache"""
+        try:
+            if self.writer:
+                self.writer.close()
+                self.writer = None
+            if self.exporter:
+                self.exporter.close()
+                self.exporter = None
+            if self.output:
+                self.output.close()
+                self.output = None
+            if self.store:
+                self.store.close()
+                self.store = None
+            if self.cache:
+                self.cache.close()
+                self.cache = None
+        except Exception as e:
+            log_error(f"close_state error: {e}\n{traceback.format_exc()}", stage="cleanup")
+
+    def close(self):
+        self.close_engines()
+        self.close_state()
+
+    def summary(self):
+        """Return the end-of-run metrics summary"""
+        return METRICS.summary_text()
@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+import traceback
+
+from logs import log_error
+from metrics import METRICS
+from output import NOT_FOUND
+
+_STOP = object()
+
+
+class ResultWriter(threading.Thread):
+    """Background thread that persists finished tasks so crawl threads never wait on disk I/O.
+
+    Results arrive through a bounded queue: when the disk falls behind, done() and failed() block
+    until there is room again. They are written in batches of batch_size, or every flush_interval
+    seconds, and each batch is written to the output before the job store marks its rows done, so
+    a crash can never leave a row marked done without its lyrics.
+    """
+
+    def __init__(self, output, store=None, cache=None, max_pending=5000, batch_size=500, flush_interval=2.0):
+        super().__init__(name="result-writer", daemon=True)
+        self.output = output
+        self.store = store
+        self.cache = cache
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.written = 0  # Rows persisted so far
+
+    def done(self, task, lyrics, latency, cached=False):
+        """Queue a finished task (see scheduler.make_task); lyrics is None when none were found"""
+        self.queue.put(("done", task, lyrics, latency, cached))
+
+    def failed(self, task, error, latency, final):
+        """Queue a failed attempt; non-final failures keep the rows pending in the job store"""
+        self.queue.put(("failed", task, str(error), latency, final))
+
+    def run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self.flush(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+        self.flush(batch)
+
+    def flush(self, batch):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            files, done, failed, cached = [], [], [], []
+            for kind, task, value, latency, flag in batch:
+                key, _, _, rows = task
+                row_ids = [row[0] for row in rows]
+                if kind == "done":
+                    # The output decides how to record songs without lyrics; the job store keeps NOT_FOUND
+                    files.extend((row[1], row[2], value) for row in rows)
+                    source = ("cache" if flag else getattr(value, "source", None)) if value else None
+                    done.append((row_ids, value or NOT_FOUND, latency, source))
+                    if not flag:
+                        cached.append((key, value))
+                else:
+                    failed.append((row_ids, value, latency, flag))
+            self.output.write_many(files)
+            if self.store:
+                self.store.record_batch(done, failed)
+            if self.cache:
+                self.cache.put_many(cached)
+            self.written += len(files)
+            METRICS.observe("write_batch", time.perf_counter() - started)
+        except Exception as e:
+            log_error(f"ResultWriter flush error: {e}\n{traceback.format_exc()}", stage="write")
+
+    def close(self):
+        """Write everything still queued and stop the thread"""
+        self.queue.put(_STOP)
+        self.join()